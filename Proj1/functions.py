@@ -20,43 +20,1082 @@ id = len(lista)+1
 
 -----------------'''
 
+import os
+import re
+import csv
+import json
+import time
+import codecs
+import shutil
+import tempfile
+import sqlite3
+import hashlib
+import itertools
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+import numpy as np
 import pandas as pd
 import sqlalchemy
+from sqlalchemy.dialects.mysql import insert as insert_mysql
 import matplotlib.pyplot as plt
 
-# Conexión a la base de datos (cambia prueba1 por tu base si deseas.)
+# Conexión a la base de datos (cambia prueba1 por tu base si deseas.)
+# El engine se crea recién la primera vez que se usa (importar functions no se conecta
+# a nada) y hay uno solo por proceso: todas las sesiones del dashboard comparten su pool.
+# Se configura en CONFIG_DB, con configurar_engine() o con variables de entorno:
+#   DB_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE (segundos), DB_POOL_PRE_PING (1/0)
+CONFIG_DB = {
+    "url": "mysql+pymysql://root:@localhost/prueba1",
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_recycle": 3600,   # MySQL corta las conexiones inactivas (wait_timeout)
+    "pool_pre_ping": True,  # prueba la conexión antes de usarla
+}
+
+def _leer_entorno_db():
+    convertir = {"url": str, "pool_size": int, "max_overflow": int, "pool_recycle": int,
+                 "pool_pre_ping": lambda v: v.strip().lower() in ("1", "true", "si", "sí")}
+    for clave, funcion in convertir.items():
+        valor = os.environ.get(f"DB_{clave.upper()}")
+        if valor:
+            CONFIG_DB[clave] = funcion(valor)
+
+_leer_entorno_db()
+_engine = None
+_lock_engine = threading.Lock()
+_uso_pool = {"pedidos": 0, "conexiones_abiertas": 0}
+
+# Opciones de pool de CONFIG_DB, para el engine principal y los motores aparte
+# (LOAD DATA, reportes en otra base)
+def _opciones_pool(url):
+    opciones = {"pool_pre_ping": CONFIG_DB["pool_pre_ping"], "pool_recycle": CONFIG_DB["pool_recycle"]}
+    # SQLite no usa un pool de tamaño fijo
+    if not str(url).startswith("sqlite"):
+        opciones.update(pool_size=CONFIG_DB["pool_size"], max_overflow=CONFIG_DB["max_overflow"])
+    return opciones
+
+def obtener_engine():
+    global _engine
+    if _engine is None:
+        with _lock_engine:
+            if _engine is None:
+                motor = sqlalchemy.create_engine(CONFIG_DB["url"], **_opciones_pool(CONFIG_DB["url"]))
+                sqlalchemy.event.listen(motor, "checkout", _al_pedir_conexion)
+                sqlalchemy.event.listen(motor, "connect", _al_abrir_conexion)
+                _engine = motor
+    return _engine
+
+def _al_pedir_conexion(conexion, registro, proxy):
+    _uso_pool["pedidos"] += 1
+
+def _al_abrir_conexion(conexion, registro):
+    _uso_pool["conexiones_abiertas"] += 1
+
+# Cambia la configuración; el próximo obtener_engine() crea el engine nuevo.
+# Los motores aparte también se cierran y se vuelven a crear con la config nueva.
+def configurar_engine(url=None, **opciones):
+    global _engine
+    with _lock_engine:
+        if url:
+            CONFIG_DB["url"] = url
+        CONFIG_DB.update(opciones)
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+        for motores in (_motores_archivo, _motores):
+            for motor in motores.values():
+                motor.dispose()
+            motores.clear()
 
-engine = sqlalchemy.create_engine("mysql+pymysql://root:@localhost/prueba1")
+def estadisticas_pool():
+    if _engine is None:
+        return {"creado": False, "url": CONFIG_DB["url"]}
+    pool = _engine.pool
+    datos = {"creado": True, "url": _engine.url.render_as_string(hide_password=True), "tipo": type(pool).__name__, **_uso_pool}
+    for clave, metodo in (("tamaño", "size"), ("en_uso", "checkedout"), ("libres", "checkedin"), ("desborde", "overflow")):
+        if hasattr(pool, metodo):
+            datos[clave] = getattr(pool, metodo)()
+    return datos
 
 # Diccionario para almacenar los DataFrames y sus rutas
 # Diccionario global
-csvs = {}  # nombre_archivo : {"df": DataFrame, "ruta": str, "formato": str}
+csvs = {}  # nombre_archivo : {"df": DataFrame, "ruta": str, "formato": str, "encoding": str, "sep": str}
+
+#-----------------
+# Formatos que se pueden leer y cantidad de workers para cargar directorios
+FORMATOS = ("csv", "json", "xml")
+WORKERS_CARGA = 4
+
+# Bytes que se miran para adivinar encoding y separador de un CSV
+BYTES_MUESTRA = 64 * 1024
+SEPARADORES = ",;\t|"
+
+#-----------------
+# Detectar encoding y separador mirando solo el comienzo del archivo
+# origen puede ser una ruta o un archivo abierto en binario (ej: subido en streamlit)
+def detectar_formato_csv(origen, bytes_muestra=BYTES_MUESTRA):
+    if isinstance(origen, (str, os.PathLike)):
+        with open(origen, "rb") as f:
+            muestra = f.read(bytes_muestra)
+    else:
+        posicion = origen.tell()
+        muestra = origen.read(bytes_muestra)
+        origen.seek(posicion)
+
+    if muestra.startswith(codecs.BOM_UTF8):
+        encoding = "utf-8-sig"
+    else:
+        try:
+            # final=False para no fallar si la muestra corta un caracter a la mitad
+            codecs.getincrementaldecoder("utf-8")().decode(muestra, final=False)
+            encoding = "utf-8"
+        except UnicodeDecodeError:
+            # latin-1 (= iso-8859-1) acepta cualquier byte
+            encoding = "latin-1"
+
+    lineas = muestra.decode(encoding, errors="ignore").splitlines()[:50]
+    try:
+        sep = csv.Sniffer().sniff("\n".join(lineas), delimiters=SEPARADORES).delimiter
+    except csv.Error:
+        sep = ","
+    return encoding, sep
+
+#-----------------
+# Leer un CSV una sola vez con el encoding/separador detectado (o ya conocido)
+def leer_csv(origen, encoding=None, sep=None):
+    if encoding is None or sep is None:
+        encoding_detectado, sep_detectado = detectar_formato_csv(origen)
+        encoding = encoding or encoding_detectado
+        sep = sep or sep_detectado
+    try:
+        df = pd.read_csv(origen, encoding=encoding, sep=sep)
+    except UnicodeDecodeError:
+        # Hay bytes inválidos después de la muestra: un único reintento con latin-1
+        if hasattr(origen, "seek"):
+            origen.seek(0)
+        encoding = "latin-1"
+        df = pd.read_csv(origen, encoding=encoding, sep=sep)
+    return df, encoding, sep
+
+#-----------------
+# Esquema de la base (prueba3.sql) para saber el tipo de cada columna
+ESQUEMA_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prueba3.sql")
+USAR_ESQUEMA = True
+# Un varchar pasa a category si tiene pocos valores distintos respecto a las filas
+PROPORCION_CATEGORIA = 0.5
+
+_esquema = None
+_firma_esquema = None  # tamaño y fecha de prueba3.sql cuando se leyó
+
+def leer_esquema_sql(ruta=ESQUEMA_SQL):
+    with open(ruta, encoding="utf-8") as f:
+        texto = f.read()
+    tablas = {}
+    for tabla in re.finditer(r"CREATE TABLE `(\w+)` \((.*?)\n\)", texto, re.S):
+        columnas, definiciones = {}, {}
+        for linea in tabla.group(2).splitlines():
+            col = re.match(r"\s*`(\w+)`\s+(\w+(?:\([\d,]+\))?)", linea)
+            if col:
+                columnas[col.group(1)] = col.group(2).lower()
+                # Definición completa (tipo, NOT NULL, DEFAULT) para crear la tabla igual en la base
+                definiciones[col.group(1)] = linea.strip().rstrip(",")[len(col.group(1)) + 2:].strip()
+        tablas[tabla.group(1)] = {"columnas": columnas, "definiciones": definiciones, "pk": [], "fk": [], "indices": []}
+    # Claves primarias, foráneas y AUTO_INCREMENT vienen en los ALTER TABLE del final del dump
+    for alter in re.finditer(r"ALTER TABLE `(\w+)`(.*?);", texto, re.S):
+        tabla = tablas.get(alter.group(1))
+        if tabla is None:
+            continue
+        pk = re.search(r"PRIMARY KEY \(([^)]*)\)", alter.group(2))
+        if pk:
+            tabla["pk"] = re.findall(r"`(\w+)`", pk.group(1))
+        # indices: [(nombre, columnas, unico)]
+        for indice in re.finditer(r"ADD (UNIQUE )?KEY `(\w+)` \(([^)]*)\)", alter.group(2)):
+            tabla["indices"].append((indice.group(2), re.findall(r"`(\w+)`", indice.group(3)), bool(indice.group(1))))
+        auto = re.search(r"AUTO_INCREMENT=(\d+)", alter.group(2))
+        if auto:
+            tabla["auto_increment"] = int(auto.group(1))
+        columna_auto = re.search(r"MODIFY `(\w+)`[^,;]*\bAUTO_INCREMENT\b", alter.group(2))
+        if columna_auto:
+            tabla["columna_auto"] = columna_auto.group(1)
+        # fk: [(columnas, tabla_referenciada, columnas_referenciadas)]
+        for fk in re.finditer(r"FOREIGN KEY \(([^)]*)\) REFERENCES `(\w+)` \(([^)]*)\)", alter.group(2)):
+            tabla["fk"].append((re.findall(r"`(\w+)`", fk.group(1)), fk.group(2), re.findall(r"`(\w+)`", fk.group(3))))
+    return tablas
+
+def esquema():
+    global _esquema, _firma_esquema
+    # Se vuelve a leer si prueba3.sql cambió
+    firma = _firma_archivo_o_none(ESQUEMA_SQL)
+    if _esquema is None or firma != _firma_esquema:
+        try:
+            _esquema = leer_esquema_sql()
+        except OSError:
+            print(f"⚠️ No se encontró el esquema {ESQUEMA_SQL}, se usan los tipos de pandas.")
+            _esquema = {}
+        _firma_esquema = firma
+    return _esquema
+
+# Lo que decide los tipos con que se lee una tabla. Las copias en caché lo guardan
+# y dejan de servir si cambia prueba3.sql o la configuración de tipos.
+def firma_esquema():
+    return {"usar": USAR_ESQUEMA, "archivo": _firma_archivo_o_none(ESQUEMA_SQL), "categoria": PROPORCION_CATEGORIA}
+
+# Una tabla traída de la base con otro nombre (cargar_desde_sql) usa el esquema de su tabla de origen
+def esquema_tabla(nombre):
+    return esquema().get(csvs.get(nombre, {}).get("tabla_sql") or nombre)
+
+#-----------------
+# Elegir el dtype compacto de cada columna según el tipo SQL declarado
+# int(11) -> int32, varchar repetitivo -> category, date -> datetime64
+# decimal queda en float64: pasarlo a enteros escalados cambiaría todas las cuentas
+# Columnas fuera del esquema que se llaman fecha... también se intentan leer como fecha
+PATRON_FECHA = re.compile(r"^fecha|fecha$", re.I)
+
+def planificar_tipos(nombre, df):
+    tabla = esquema().get(nombre) or {"columnas": {}}
+    plan = {}
+    for col in df.columns:
+        if col not in tabla["columnas"] and PATRON_FECHA.search(str(col)) and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            plan[col] = "datetime64[ns]"
+    for col, tipo in tabla["columnas"].items():
+        if col not in df.columns:
+            continue
+        base = tipo.split("(")[0]
+        if base == "tinyint":
+            plan[col] = "int8"
+        elif base == "smallint":
+            plan[col] = "int16"
+        elif base in ("int", "mediumint"):
+            plan[col] = "int32"
+        elif base in ("date", "datetime", "timestamp"):
+            plan[col] = "datetime64[ns]"
+        elif base in ("decimal", "float", "double"):
+            plan[col] = "float64"
+        elif base in ("varchar", "char") and len(df):
+            if df[col].nunique() / len(df) <= PROPORCION_CATEGORIA:
+                plan[col] = "category"
+    return plan
+
+def aplicar_tipos(nombre, df, categorias=True):
+    if not USAR_ESQUEMA:
+        return df
+    for col, tipo in planificar_tipos(nombre, df).items():
+        # Por partes (streaming) cada parte tendría categorías distintas
+        if tipo == "category" and not categorias:
+            continue
+        serie = df[col]
+        nulos = serie.isna().sum()
+        try:
+            if tipo.startswith("datetime"):
+                nueva = pd.to_datetime(serie, errors="coerce")
+            elif tipo.startswith("int"):
+                nueva = pd.to_numeric(serie, errors="coerce")
+                limites = np.iinfo(tipo)
+                if nueva.min() < limites.min or nueva.max() > limites.max:
+                    continue
+                if nueva.isna().any():
+                    nueva = nueva.astype(tipo.capitalize())  # Int32 admite nulos
+                elif (nueva % 1 == 0).all():
+                    nueva = nueva.astype(tipo)
+                else:
+                    continue
+            elif tipo == "float64":
+                nueva = pd.to_numeric(serie, errors="coerce")
+            else:
+                nueva = serie.astype(tipo)
+        except (ValueError, TypeError, OverflowError):
+            continue
+        # Si la conversión perdió datos (valores que no se pudieron convertir) se deja como estaba
+        if nueva.isna().sum() != nulos:
+            continue
+        df[col] = nueva
+    return df
+
+#-----------------
+# Códigos de período de una columna fecha, como enteros chicos para agrupar rápido:
+# anio (2024), trimestre (20242 = 2º trimestre de 2024), mes (202405). Fecha vacía -> -1
+def codigos_periodo(serie):
+    fechas = pd.to_datetime(serie, errors="coerce")
+    anio = fechas.dt.year
+    return pd.DataFrame({
+        "anio": anio.fillna(-1).astype("int32"),
+        "trimestre": (anio * 10 + fechas.dt.quarter).fillna(-1).astype("int32"),
+        "mes": (anio * 100 + fechas.dt.month).fillna(-1).astype("int32"),
+    }, index=serie.index)
+
+# Se calculan una vez al cargar, para todas las columnas fecha de la tabla
+def calcular_periodos(df):
+    return {col: codigos_periodo(df[col]) for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])}
+
+# Códigos guardados en el registro (no se agregan al df para no escribirlos al guardar).
+# Las ediciones los mantienen (ver _actualizar_periodos); si igual no coinciden con la
+# tabla se recalculan.
+def periodos(nombre, columna="fecha"):
+    datos = csvs[nombre]
+    df = datos["df"]
+    if df is None:  # streaming: no hay tabla entera para guardarle los códigos
+        return None
+    guardados = datos.setdefault("periodos", {})
+    codigos = guardados.get(columna)
+    if codigos is None or len(codigos) != len(df):
+        codigos = guardados[columna] = codigos_periodo(df[columna])
+    return codigos
+
+# Después de una edición solo se calculan los códigos de las filas nuevas o modificadas;
+# los de las demás se copian, y las bajas los sacan por posición.
+# origen: para cada fila actual, su posición antes de las ediciones (-1 si hay que calcularla)
+def _actualizar_periodos(nombre, df, filas_antes, ops):
+    guardados = csvs[nombre].get("periodos")
+    if not guardados or all(op["op"] == "modificar" and op["columna"] not in guardados for op in ops):
+        return
+    origen = {col: np.arange(filas_antes) for col in guardados}
+    for op in ops:
+        if op["op"] == "modificar":
+            if op["columna"] in origen:
+                origen[op["columna"]][int(op["fila"])] = -1
+        elif op["op"] == "agregar":
+            for col in origen:
+                origen[col] = np.concatenate([origen[col], np.full(len(op["filas"]), -1)])
+        elif op["op"] == "eliminar":
+            for col in origen:
+                origen[col] = np.delete(origen[col], [int(fila) for fila in op["filas"]])
+    for col, codigos in list(guardados.items()):
+        posiciones = origen[col]
+        if len(posiciones) != len(df) or col not in df.columns or len(codigos) != filas_antes:
+            del guardados[col]
+            continue
+        if filas_antes:
+            valores = codigos.to_numpy()[np.maximum(posiciones, 0)]
+        else:
+            valores = np.full((len(df), codigos.shape[1]), -1, dtype="int32")
+        calcular = np.flatnonzero(posiciones == -1)
+        if len(calcular):
+            valores[calcular] = codigos_periodo(df[col].iloc[calcular]).to_numpy()
+        guardados[col] = pd.DataFrame(valores, columns=codigos.columns, index=df.index).astype("int32")
+
+#-----------------
+# Convertir un valor ingresado como texto al tipo de la columna
+def convertir_valor(serie, valor):
+    if valor is None or (isinstance(valor, str) and valor.strip() == ""):
+        return None
+    if not isinstance(valor, str):
+        return valor
+    try:
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            return pd.to_datetime(valor)
+        if pd.api.types.is_bool_dtype(serie):
+            return valor.strip().lower() in ("1", "true", "si", "sí", "s")
+        if pd.api.types.is_integer_dtype(serie):
+            numero = pd.to_numeric(valor)
+            return int(numero) if numero == int(numero) else numero
+        if pd.api.types.is_float_dtype(serie):
+            return float(valor)
+    except (ValueError, TypeError):
+        pass
+    return valor
+
+def _columna_admite(df, columna, valor):
+    serie = df[columna]
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        if valor is not None and valor not in serie.cat.categories:
+            df[columna] = serie.cat.add_categories([valor])
+        return
+    if valor is None:
+        # int32 no admite nulos, Int32 sí
+        if pd.api.types.is_integer_dtype(serie) and isinstance(serie.dtype, np.dtype):
+            df[columna] = serie.astype(serie.dtype.name.capitalize())
+        return
+    try:
+        entra = pd.Series([valor]).astype(serie.dtype).iloc[0] == valor
+    except (ValueError, TypeError, OverflowError):
+        entra = False
+    if not entra:
+        # El valor no entra en el dtype actual: la columna pasa a object
+        df[columna] = serie.astype(object)
+
+#-----------------
+# Modificar una celda respetando el dtype (compacto) de la columna
+def asignar_celda(df, fila, columna, valor):
+    valor = convertir_valor(df[columna], valor)
+    _columna_admite(df, columna, valor)
+    df.at[fila, columna] = valor if valor is not None else np.nan
+    return df
+
+#-----------------
+# Añadir filas (lista de dicts) manteniendo los dtypes de la tabla
+def concatenar_filas(df, filas):
+    nuevas = pd.DataFrame(filas, columns=df.columns)
+    for col in df.columns:
+        nuevas[col] = [convertir_valor(df[col], v) for v in nuevas[col]]
+    resultado = pd.concat([df, nuevas], ignore_index=True)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and not isinstance(resultado[col].dtype, pd.CategoricalDtype):
+            resultado[col] = resultado[col].astype("category")
+        elif resultado[col].dtype != df[col].dtype:
+            try:
+                resultado[col] = resultado[col].astype(df[col].dtype)
+            except (ValueError, TypeError):
+                pass
+    return resultado
+
+#-----------------
+# Leer un archivo según su formato
+# Devuelve el DataFrame y los datos extra para guardar en el registro (encoding, sep)
+def leer_archivo(ruta, formato, encoding=None, sep=None):
+    nombre = os.path.splitext(os.path.basename(ruta))[0]
+    if formato == "csv":
+        df, encoding, sep = leer_csv(ruta, encoding, sep)
+        return aplicar_tipos(nombre, df), {"encoding": encoding, "sep": sep}
+    elif formato == "json":
+        return aplicar_tipos(nombre, pd.read_json(ruta)), {}
+    elif formato == "xml":
+        return aplicar_tipos(nombre, pd.read_xml(ruta)), {}
+    raise ValueError(f"Formato no soportado: {ruta}")
+
+#-----------------
+# Caché en disco de las tablas leídas (parquet si está pyarrow, sino pickle)
+# Cada archivo fuente tiene su copia en DIR_CACHE, válida mientras no cambie
+# su tamaño ni su fecha de modificación, ni el esquema con que se tipó (firma_esquema).
+DIR_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache_datos")
+USAR_CACHE = True
+
+try:
+    import pyarrow  # noqa: F401
+    FORMATO_CACHE = "parquet"
+except ImportError:
+    FORMATO_CACHE = "pickle"
+
+def _ruta_cache(ruta):
+    clave = hashlib.sha1(os.path.abspath(ruta).encode("utf-8")).hexdigest()[:16]
+    base = os.path.splitext(os.path.basename(ruta))[0]
+    return os.path.join(DIR_CACHE, f"{base}_{clave}")
+
+def _firma_archivo(ruta):
+    info = os.stat(ruta)
+    return {"tamaño": info.st_size, "mtime": info.st_mtime_ns}
+
+def _firma_archivo_o_none(ruta):
+    try:
+        return _firma_archivo(ruta)
+    except OSError:
+        return None
+
+def borrar_cache(ruta):
+    base = _ruta_cache(ruta)
+    for ext in (".json", ".parquet", ".pkl"):
+        if os.path.exists(base + ext):
+            os.remove(base + ext)
+
+def leer_cache(ruta):
+    base = _ruta_cache(ruta)
+    try:
+        with open(base + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # El archivo fuente (o el esquema con que se tipó) cambió: la copia ya no sirve
+    if meta.get("firma") != _firma_archivo(ruta) or meta.get("esquema") != firma_esquema():
+        borrar_cache(ruta)
+        return None
+    try:
+        if meta["formato_cache"] == "parquet":
+            df = pd.read_parquet(base + ".parquet")
+        else:
+            df = pd.read_pickle(base + ".pkl")
+    except Exception:
+        borrar_cache(ruta)
+        return None
+    return df, meta["extra"]
+
+def escribir_cache(ruta, df, extra):
+    try:
+        os.makedirs(DIR_CACHE, exist_ok=True)
+        borrar_cache(ruta)
+        base = _ruta_cache(ruta)
+        formato_cache = FORMATO_CACHE
+        if formato_cache == "parquet":
+            try:
+                df.to_parquet(base + ".parquet", index=False)
+            except Exception:
+                # Columnas con tipos mezclados que parquet no acepta
+                formato_cache = "pickle"
+        if formato_cache == "pickle":
+            df.to_pickle(base + ".pkl")
+        # El .json se escribe al final: sin él la copia no se considera válida
+        meta = {"firma": _firma_archivo(ruta), "esquema": firma_esquema(), "formato_cache": formato_cache, "extra": extra}
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar la caché de {ruta}: {e}")
+
+def limpiar_cache():
+    if os.path.isdir(DIR_CACHE):
+        shutil.rmtree(DIR_CACHE)
+
+#-----------------
+# Encoding y separador ya conocidos de un CSV, para no volver a detectarlos al recargarlo:
+# los de su entrada en el registro o los guardados con su copia en caché (aunque la copia
+# haya quedado vieja, por ejemplo después de guardar_archivo()). (None, None) si no hay.
+def formato_conocido(ruta):
+    ruta_abs = os.path.abspath(ruta)
+    for datos in list(csvs.values()):
+        if datos.get("encoding") and datos.get("ruta") and os.path.abspath(datos["ruta"]) == ruta_abs:
+            return datos["encoding"], datos.get("sep")
+    try:
+        with open(_ruta_cache(ruta) + ".json", encoding="utf-8") as f:
+            extra = json.load(f).get("extra", {})
+    except (OSError, ValueError):
+        return None, None
+    return extra.get("encoding"), extra.get("sep")
+
+#-----------------
+# Leer un archivo pasando por la caché
+# Devuelve (df, extra, desde_cache)
+def leer_archivo_cacheado(ruta, formato, encoding=None, sep=None):
+    if formato == "csv" and (encoding is None or sep is None):
+        # Antes de leer_cache(), que borra el .json si la copia quedó vieja
+        conocido = formato_conocido(ruta)
+        encoding, sep = encoding or conocido[0], sep or conocido[1]
+    if USAR_CACHE:
+        cacheado = leer_cache(ruta)
+        if cacheado is not None:
+            df, extra = cacheado
+            return df, extra, True
+    df, extra = leer_archivo(ruta, formato, encoding, sep)
+    if USAR_CACHE:
+        escribir_cache(ruta, df, extra)
+    return df, extra, False
+
+def _leer_con_tiempo(ruta, formato, encoding=None, sep=None):
+    inicio = time.perf_counter()
+    df, extra, desde_cache = leer_archivo_cacheado(ruta, formato, encoding, sep)
+    df, pendientes = reproducir_journal(ruta, df)
+    if pendientes:
+        extra = {**extra, "journal": pendientes}
+    if df is not None:
+        extra = {**extra, "periodos": calcular_periodos(df)}
+    return df, extra, desde_cache, time.perf_counter() - inicio
+
+#-----------------
+# Journal de cambios: cada edición se agrega al final de <ruta>.journal (una línea JSON
+# por operación) en vez de reescribir el archivo entero. Al cargar se vuelve a aplicar.
+# guardar_archivo() / compactar() vuelcan todo al archivo base y borran el journal.
+# Operaciones:
+#   {"op": "modificar", "fila": int, "columna": str, "valor": ...}
+#   {"op": "agregar", "filas": [dict, ...]}
+#   {"op": "eliminar", "filas": [int, ...]}
+MAX_JOURNAL = 1000  # operaciones pendientes; al superarlo se compacta solo
+
+def _ruta_journal(ruta):
+    return ruta + ".journal"
+
+def aplicar_op(df, op):
+    if op["op"] == "modificar":
+        asignar_celda(df, int(op["fila"]), op["columna"], op["valor"])
+    elif op["op"] == "agregar":
+        df = concatenar_filas(df, op["filas"])
+    elif op["op"] == "eliminar":
+        df = df.drop([int(fila) for fila in op["filas"]]).reset_index(drop=True)
+    else:
+        raise ValueError(f"Operación desconocida: {op['op']}")
+    return df
+
+# Un journal que no parte del archivo base actual no se puede aplicar: se deja aparte
+# (<ruta>.journal.viejo) para no perder los cambios y el próximo cambio arranca uno nuevo
+def _apartar_journal(ruta):
+    ruta_journal = _ruta_journal(ruta)
+    os.replace(ruta_journal, ruta_journal + ".viejo")
+    print(f"⚠️ {ruta} cambió por fuera del dashboard: no se aplica {ruta_journal} (queda en {ruta_journal}.viejo)")
+
+def _base_journal(ruta_journal):
+    with open(ruta_journal, encoding="utf-8") as f:
+        primera = f.readline()
+    try:
+        return json.loads(primera).get("base")
+    except ValueError:
+        return None
+
+def escribir_journal(ruta, ops):
+    ruta_journal = _ruta_journal(ruta)
+    lineas = [json.dumps(op, ensure_ascii=False, default=str) for op in ops]
+    # Nunca se agrega a un journal de otra versión del archivo: se perdería al recargar
+    if os.path.exists(ruta_journal) and _base_journal(ruta_journal) != _firma_archivo(ruta):
+        _apartar_journal(ruta)
+    if not os.path.exists(ruta_journal):
+        # Primera línea: de qué versión del archivo base parten los cambios
+        lineas.insert(0, json.dumps({"base": _firma_archivo(ruta)}))
+    # Todo el lote en una sola escritura
+    with open(ruta_journal, "a", encoding="utf-8") as f:
+        f.write("\n".join(lineas) + "\n")
+
+def reproducir_journal(ruta, df):
+    ruta_journal = _ruta_journal(ruta)
+    if not os.path.exists(ruta_journal):
+        return df, 0
+    with open(ruta_journal, encoding="utf-8") as f:
+        lineas = [json.loads(linea) for linea in f if linea.strip()]
+    if not lineas:
+        return df, 0
+    if lineas[0].get("base") != _firma_archivo(ruta):
+        _apartar_journal(ruta)
+        return df, 0
+    for op in lineas[1:]:
+        df = aplicar_op(df, op)
+    return df, len(lineas) - 1
+
+#-----------------
+# Aplicar ediciones a una tabla del registro: en memoria + journal
+def editar_tabla(nombre, ops):
+    datos = csvs[nombre]
+    if es_streaming(nombre):
+        raise ValueError(f"{nombre} está en modo streaming (solo lectura)")
+    df = datos["df"]
+    cambios = _filas_previas_cubo(nombre, df, ops)
+    for op in ops:
+        df = aplicar_op(df, op)
+    _tabla_editada(nombre, df, ops, cambios)
+    return df
+
+# Lo que hay que actualizar después de cada edición (individual o en lote)
+# cambios: filas previas para el cubo de ventas (ver _filas_previas_cubo)
+def _tabla_editada(nombre, df, ops, cambios=None):
+    datos = csvs[nombre]
+    escribir_journal(datos["ruta"], ops)
+    version_anterior = version_tabla(nombre)
+    filas_antes = len(datos["df"])
+    datos["df"] = df
+    datos["journal"] = datos.get("journal", 0) + len(ops)
+    _nueva_version(nombre)
+    _actualizar_indice(nombre, df, filas_antes, ops)
+    _actualizar_periodos(nombre, df, filas_antes, ops)
+    _actualizar_cubo(nombre, df, cambios, version_anterior)
+    if datos["journal"] > MAX_JOURNAL:
+        compactar(nombre)
+
+#-----------------
+# Ediciones en lote: se acumulan, se previsualizan y se confirman juntas.
+# Las filas de "modificar" y "eliminar" se refieren a la tabla como estaba antes del lote.
+def ordenar_lote(ops):
+    # Orden canónico: modificaciones, altas y al final una sola baja.
+    # Así el journal, que se aplica en orden, da el mismo resultado que el lote.
+    modificaciones = {}
+    for op in ops:
+        if op["op"] == "modificar":
+            modificaciones[(int(op["fila"]), op["columna"])] = op  # la última gana
+    filas_nuevas = [fila for op in ops if op["op"] == "agregar" for fila in op["filas"]]
+    bajas = sorted({int(fila) for op in ops if op["op"] == "eliminar" for fila in op["filas"]})
+    ordenadas = list(modificaciones.values())
+    if filas_nuevas:
+        ordenadas.append({"op": "agregar", "filas": filas_nuevas})
+    if bajas:
+        ordenadas.append({"op": "eliminar", "filas": bajas})
+    return ordenadas
+
+def previsualizar_lote(df, ops):
+    cambios = []
+    for op in ordenar_lote(ops):
+        if op["op"] == "modificar":
+            cambios.append({"accion": "modificar", "fila": op["fila"], "columna": op["columna"],
+                            "antes": df.iat[int(op["fila"]), df.columns.get_loc(op["columna"])], "despues": op["valor"]})
+        elif op["op"] == "agregar":
+            for fila in op["filas"]:
+                cambios.append({"accion": "agregar", "fila": None, "columna": None, "antes": None, "despues": fila})
+        else:
+            for fila in op["filas"]:
+                cambios.append({"accion": "eliminar", "fila": fila, "columna": None,
+                                "antes": df.iloc[fila].to_dict(), "despues": None})
+    return pd.DataFrame(cambios, columns=["accion", "fila", "columna", "antes", "despues"])
+
+def aplicar_lote(df, ops):
+    ops = ordenar_lote(ops)
+    # Modificaciones: una asignación por columna
+    por_columna = {}
+    for op in ops:
+        if op["op"] == "modificar":
+            por_columna.setdefault(op["columna"], []).append(op)
+    for columna, cambios in por_columna.items():
+        filas = [int(op["fila"]) for op in cambios]
+        valores = [convertir_valor(df[columna], op["valor"]) for op in cambios]
+        for valor in set(v for v in valores if v is not None):
+            _columna_admite(df, columna, valor)
+        if None in valores:
+            _columna_admite(df, columna, None)
+        # Con el dtype de la columna: una lista de int de Python no entra en una columna int32
+        valores = pd.array([np.nan if v is None else v for v in valores], dtype=df[columna].dtype)
+        df.iloc[filas, df.columns.get_loc(columna)] = valores
+    for op in ops:
+        if op["op"] == "agregar":
+            df = concatenar_filas(df, op["filas"])
+        elif op["op"] == "eliminar":
+            df = df.drop(op["filas"]).reset_index(drop=True)
+    return df, ops
+
+#-----------------
+# Confirmar un lote: se aplica sobre una copia y se escribe el journal una sola vez.
+# Si algo falla la tabla queda como estaba.
+def confirmar_lote(nombre, ops):
+    if not ops:
+        return csvs[nombre]["df"]
+    if es_streaming(nombre):
+        raise ValueError(f"{nombre} está en modo streaming (solo lectura)")
+    cambios = _filas_previas_cubo(nombre, csvs[nombre]["df"], ordenar_lote(ops))
+    df, ordenadas = aplicar_lote(csvs[nombre]["df"].copy(), ops)
+    _tabla_editada(nombre, df, ordenadas, cambios)
+    return df
+
+#-----------------
+# Secuencias para las claves primarias (id autoincremental)
+# Se guarda el último id entregado en <ruta>.seq, así no se repiten ids después de
+# borrar filas. Siempre se compara con el máximo de la columna: las filas que llegan con
+# id propio (a mano, en un lote, al recargar o traer de la base) no quedan repetidas.
+_lock_secuencias = threading.Lock()
+
+def clave_primaria(nombre):
+    columnas = columnas_tabla(nombre)
+    pk = (esquema_tabla(nombre) or {}).get("pk", [])
+    if len(pk) == 1 and pk[0] in columnas:
+        return pk[0]
+    if "id" in columnas:
+        return "id"
+    return None
+
+def _ruta_secuencia(nombre):
+    return csvs[nombre]["ruta"] + ".seq"
+
+def _ultimo_id(nombre, columna):
+    # Máximo de la tabla (en streaming, el de cada parte)
+    maximos = [parte[columna].max() for parte in iterar_tabla(nombre, columnas=[columna]) if len(parte)]
+    maximos = [m for m in maximos if pd.notna(m)]
+    ultimo = int(max(maximos)) if maximos else 0
+    try:
+        with open(_ruta_secuencia(nombre), encoding="utf-8") as f:
+            secuencia = json.load(f)
+        if secuencia.get("columna") == columna:
+            ultimo = max(ultimo, int(secuencia["ultimo"]))
+    except (OSError, ValueError, KeyError):
+        pass
+    return ultimo
+
+def siguiente_id(nombre):
+    columna = clave_primaria(nombre)
+    if columna is None:
+        return None
+    with _lock_secuencias:
+        return _ultimo_id(nombre, columna) + 1
+
+# Reservar ids de una vez (para altas en lote)
+def reservar_ids(nombre, cantidad=1):
+    columna = clave_primaria(nombre)
+    if columna is None:
+        return []
+    with _lock_secuencias:
+        ultimo = _ultimo_id(nombre, columna)
+        with open(_ruta_secuencia(nombre), "w", encoding="utf-8") as f:
+            json.dump({"columna": columna, "ultimo": ultimo + cantidad}, f)
+    return list(range(ultimo + 1, ultimo + cantidad + 1))
 
 #-----------------
-# Cargar archivos
+# Índice por clave primaria: id -> posición de la fila (tabla hash de pandas)
+# Se arma la primera vez que se usa y se mantiene con las ediciones: las altas y los
+# cambios de clave van a un dict aparte ("nuevas"), sin rehacer la tabla hash. Cada
+# posición encontrada se confirma contra la fila, así una clave que cambió deja de valer.
+# Se rearma solo con bajas (corren las posiciones) o cuando "nuevas" pasa de
+# PROPORCION_INDICE de las filas.
+PROPORCION_INDICE = 0.1
+
+def indice_pk(nombre):
+    pk = clave_primaria(nombre)
+    if pk is None or es_streaming(nombre):
+        return None, None
+    datos = csvs[nombre]
+    df = datos["df"]
+    guardado = datos.get("indice")
+    if guardado is None or guardado["df"]() is not df:
+        base = pd.Series(np.arange(len(df)), index=df[pk].to_numpy())
+        if not base.index.is_unique:
+            print(f"⚠️ {nombre}.{pk} tiene valores repetidos: se usa la primera aparición")
+            base = base[~base.index.duplicated(keep="first")]
+        datos["indice"] = {"df": weakref.ref(df), "base": base, "nuevas": {}}
+    return pk, datos["indice"]
+
+# Posición de cada clave en la tabla (-1 si no está)
+def _buscar_en_indice(indice, serie, claves):
+    base = indice["base"]
+    encontrados = base.index.get_indexer(claves)
+    desde_base = np.where(encontrados == -1, -1, base.to_numpy()[encontrados])
+    valores = serie.to_numpy()
+    posiciones = []
+    for clave, posicion in zip(claves, desde_base):
+        for candidata in (posicion, indice["nuevas"].get(clave, -1)):
+            if candidata != -1 and pd.notna(valores[candidata]) and valores[candidata] == clave:
+                posiciones.append(int(candidata))
+                break
+        else:
+            posiciones.append(-1)
+    return posiciones
+
+# Lo que cambió el índice después de una edición (filas_antes: largo de la tabla antes)
+def _actualizar_indice(nombre, df, filas_antes, ops):
+    datos = csvs[nombre]
+    indice = datos.get("indice")
+    if indice is None:
+        return
+    if any(op["op"] == "eliminar" for op in ops):
+        del datos["indice"]
+        return
+    pk = clave_primaria(nombre)
+    indice["df"] = weakref.ref(df)
+    cambiadas = {int(op["fila"]) for op in ops
+                 if op["op"] == "modificar" and op["columna"] == pk and int(op["fila"]) < filas_antes}
+    posiciones = sorted(cambiadas) + list(range(filas_antes, len(df)))
+    if not posiciones:
+        return
+    serie = df[pk]
+    for posicion, clave in zip(posiciones, serie.to_numpy()[posiciones]):
+        if pd.isna(clave):
+            continue
+        actual = _buscar_en_indice(indice, serie, [clave])[0]
+        if actual not in (-1, posicion):
+            print(f"⚠️ {nombre}.{pk} = {clave} está repetido: se usa la primera aparición")
+            continue
+        indice["nuevas"][clave] = posicion
+    if len(indice["nuevas"]) > PROPORCION_INDICE * max(len(df), 1):
+        del datos["indice"]
+
+def posiciones_por_id(nombre, ids):
+    pk, indice = indice_pk(nombre)
+    if pk is None:
+        raise ValueError(f"{nombre} no tiene clave primaria")
+    serie = csvs[nombre]["df"][pk]
+    claves = [convertir_valor(serie, i) for i in ids]
+    encontrados = _buscar_en_indice(indice, serie, claves)
+    faltantes = [i for i, e in zip(ids, encontrados) if e == -1]
+    if faltantes:
+        raise KeyError(f"No existe {pk} = {', '.join(map(str, faltantes))} en {nombre}")
+    return encontrados
+
+def buscar_por_id(nombre, id_):
+    try:
+        fila = posiciones_por_id(nombre, [id_])[0]
+    except KeyError:
+        return None
+    return csvs[nombre]["df"].iloc[fila]
+
+def modificar_por_id(nombre, id_, columna, valor):
+    fila = posiciones_por_id(nombre, [id_])[0]
+    return editar_tabla(nombre, [{"op": "modificar", "fila": fila, "columna": columna, "valor": valor}])
+
+# Modificar varias filas de una columna: cambios = {id: nuevo_valor}
+def modificar_por_ids(nombre, columna, cambios):
+    filas = posiciones_por_id(nombre, list(cambios))
+    ops = [{"op": "modificar", "fila": fila, "columna": columna, "valor": valor}
+           for fila, valor in zip(filas, cambios.values())]
+    return confirmar_lote(nombre, ops)
+
+def eliminar_por_ids(nombre, ids):
+    filas = posiciones_por_id(nombre, ids)
+    return editar_tabla(nombre, [{"op": "eliminar", "filas": filas}])
+
+#-----------------
+# Volcar el journal al archivo base
+def compactar(nombre):
+    if csvs.get(nombre, {}).get("journal"):
+        guardar_archivo(nombre)
+
+#-----------------
+# Modo streaming: tablas más grandes que la memoria
+# La entrada del registro no guarda el DataFrame ("df": None) sino cómo leerlo por partes.
+CHUNKSIZE = 100_000
+UMBRAL_STREAMING = 500 * 1024 * 1024  # bytes; los CSV más grandes se cargan en streaming
+
+def cargar_streaming(ruta, nombre=None, chunksize=CHUNKSIZE):
+    nombre = nombre or os.path.splitext(os.path.basename(ruta))[0]
+    encoding, sep = formato_conocido(ruta)
+    if encoding is None or sep is None:
+        encoding, sep = detectar_formato_csv(ruta)
+    csvs[nombre] = {
+        "df": None, "ruta": ruta, "formato": "csv",
+        "encoding": encoding, "sep": sep, "chunksize": chunksize,
+    }
+    print(f"✅ {nombre} registrado en modo streaming (partes de {chunksize} filas).")
+    return nombre
+
+def es_streaming(nombre):
+    return nombre in csvs and csvs[nombre].get("df") is None
+
+#-----------------
+# Recorrer una tabla por partes (una sola parte si está en memoria)
+def iterar_tabla(nombre, columnas=None):
+    datos = csvs[nombre]
+    if datos.get("df") is not None:
+        df = datos["df"]
+        yield df if columnas is None else df[columnas]
+        return
+    lector = pd.read_csv(
+        datos["ruta"], encoding=datos.get("encoding"), sep=datos.get("sep", ","),
+        chunksize=datos.get("chunksize", CHUNKSIZE), usecols=columnas,
+    )
+    with lector:
+        for parte in lector:
+            yield aplicar_tipos(nombre, parte, categorias=False)
+
+def columnas_tabla(nombre):
+    datos = csvs[nombre]
+    if datos.get("df") is not None:
+        return list(datos["df"].columns)
+    return list(pd.read_csv(datos["ruta"], encoding=datos.get("encoding"), sep=datos.get("sep", ","), nrows=0).columns)
+
+# Tabla completa en memoria (para tablas chicas o funciones que no trabajan por partes)
+def obtener_df(nombre):
+    if es_streaming(nombre):
+        return pd.concat(iterar_tabla(nombre), ignore_index=True)
+    return csvs[nombre]["df"]
+
+#-----------------
+# Agregar por partes: cada parte se agrupa y después se combinan los parciales
+# clave puede ser una columna o una función parte -> Serie
+def agregar_por_partes(partes, clave, columna, agregacion="sum"):
+    parciales = []
+    for parte in partes:
+        claves = clave(parte) if callable(clave) else clave
+        grupos = parte.groupby(claves, observed=True)[columna]
+        parciales.append(grupos.agg(["sum", "count"]) if agregacion == "mean" else grupos.sum())
+    if not parciales:
+        return None
+    total = pd.concat(parciales).groupby(level=0, observed=True).sum()
+    if agregacion == "mean":
+        total = (total["sum"] / total["count"]).rename(columna)
+    return total.reset_index()
+
+def _primera_parte(partes):
+    primera = next(partes, None)
+    if primera is None:
+        return None, iter(())
+    return primera, itertools.chain([primera], partes)
+
+#-----------------
+# Top k con selección parcial (nlargest / nsmallest) en vez de ordenar todo y cortar con head
+# desempate: columnas que ordenan (en el mismo sentido) las filas empatadas en la principal
+# empates: cuál de las filas empatadas en el corte queda, "first" / "last", o "all" para dejarlas todas
+# k=None devuelve todo ordenado
+TOP_K = 10
+
+def top_k(df, columna, k=TOP_K, desempate=None, ascendente=False, empates="first"):
+    columnas = [columna, *(desempate or [])]
+    if k is None:
+        return df.sort_values(by=columnas, ascending=ascendente)
+    seleccion = df.nsmallest if ascendente else df.nlargest
+    if not desempate:
+        return seleccion(k, columna, keep=empates)
+    # nlargest no acepta columnas de texto: se elige por la principal (con todos los empates
+    # del corte) y solo esas filas, en su orden original, se ordenan por el desempate
+    serie = df[columna].reset_index(drop=True)
+    posiciones = np.sort((serie.nsmallest if ascendente else serie.nlargest)(k, keep="all").index.to_numpy())
+    candidatas = df.iloc[posiciones[::-1] if empates == "last" else posiciones]
+    ordenadas = candidatas.sort_values(by=columnas, ascending=ascendente, kind="stable")
+    if empates != "all" or len(ordenadas) <= k:
+        return ordenadas.head(k)
+    resto = ordenadas.iloc[k:]
+    iguales = (resto[columnas] == ordenadas[columnas].iloc[k - 1]).all(axis=1).to_numpy()
+    return pd.concat([ordenadas.iloc[:k], resto[iguales]])
+
+# Lo mismo sobre partes: se guardan solo las k mejores vistas hasta ahora
+def top_k_partes(partes, columna, k=TOP_K, desempate=None, ascendente=False, empates="first"):
+    mejores = None
+    for parte in partes:
+        candidatas = parte if k is None else top_k(parte, columna, k, desempate, ascendente, empates)
+        if mejores is not None:
+            candidatas = pd.concat([mejores, candidatas])
+        mejores = candidatas if k is None else top_k(candidatas, columna, k, desempate, ascendente, empates)
+    if mejores is None or k is not None:
+        return mejores
+    return top_k(mejores, columna, None, desempate, ascendente)
+
+#-----------------
+# Cargar todos los archivos de un directorio en paralelo
+# progreso(i, total, info) se llama al terminar cada archivo
+# Con umbral_streaming, los CSV que lo superan se registran en modo streaming
+def cargar_directorio(directorio, workers=None, formatos=FORMATOS, procesos=False, progreso=None, umbral_streaming=None):
+    archivos = sorted(
+        f for f in os.listdir(directorio)
+        if os.path.splitext(f)[1][1:].lower() in formatos
+    )
+    tiempos = []
+    if umbral_streaming is not None:
+        for archivo in list(archivos):
+            ruta = os.path.join(directorio, archivo)
+            if archivo.lower().endswith(".csv") and os.path.getsize(ruta) > umbral_streaming:
+                cargar_streaming(ruta)
+                archivos.remove(archivo)
+    if not archivos:
+        return tiempos
+
+    pool_cls = ProcessPoolExecutor if procesos else ThreadPoolExecutor
+    with pool_cls(max_workers=workers or WORKERS_CARGA) as pool:
+        futuros = {}
+        for archivo in archivos:
+            ruta = os.path.join(directorio, archivo)
+            formato = os.path.splitext(archivo)[1][1:].lower()
+            # Con procesos el registro no llega a los hijos: el formato conocido se pasa acá
+            conocido = formato_conocido(ruta) if formato == "csv" else (None, None)
+            futuros[pool.submit(_leer_con_tiempo, ruta, formato, *conocido)] = (archivo, ruta, formato)
+
+        for i, futuro in enumerate(as_completed(futuros), 1):
+            archivo, ruta, formato = futuros[futuro]
+            nombre = os.path.splitext(archivo)[0]
+            info = {"archivo": archivo, "filas": None, "segundos": None, "cache": False, "error": None}
+            try:
+                df, extra, desde_cache, segundos = futuro.result()
+                csvs[nombre] = {"df": df, "ruta": ruta, "formato": formato, **extra}
+                info["filas"] = len(df)
+                info["segundos"] = round(segundos, 4)
+                info["cache"] = desde_cache
+            except Exception as e:
+                info["error"] = str(e)
+            tiempos.append(info)
+
+            if progreso:
+                progreso(i, len(archivos), info)
+            elif info["error"]:
+                print(f"⚠️ [{i}/{len(archivos)}] Error al cargar {archivo}: {info['error']}")
+            else:
+                print(f"✅ [{i}/{len(archivos)}] {nombre} ({info['filas']} filas, {info['segundos']:.2f}s)")
+    return tiempos
+
+#-----------------
+# Cargar archivos (o directorios completos)
 def cargar_archivos():
-    rutas = input("\nRutas de los archivos (CSV, JSON o XML, separadas por coma): ").split(",")
+    rutas = input("\nRutas de los archivos o directorios (CSV, JSON o XML, separadas por coma): ").split(",")
     for ruta in rutas:
         ruta = ruta.strip()
         if not ruta:
             continue
 
+        if os.path.isdir(ruta):
+            inicio = time.perf_counter()
+            tiempos = cargar_directorio(ruta, umbral_streaming=UMBRAL_STREAMING)
+            print(f"📂 {len(tiempos)} archivos leídos de {ruta} en {time.perf_counter() - inicio:.2f}s")
+            continue
+
         nombre = ruta.split("/")[-1].split(".")[0]
         formato = ruta.split(".")[-1].lower()
 
-        try:
-            if formato == "csv":
-                df = pd.read_csv(ruta)
-            elif formato == "json":
-                df = pd.read_json(ruta)
-            elif formato == "xml":
-                df = pd.read_xml(ruta)
-            else:
-                print(f"❌ Formato no soportado: {ruta}")
-                continue
+        if formato not in FORMATOS:
+            print(f"❌ Formato no soportado: {ruta}")
+            continue
 
-            csvs[nombre] = {"df": df, "ruta": ruta, "formato": formato}
-            print(f"✅ {nombre} ({formato}) cargado correctamente.")
+        if formato == "csv" and os.path.getsize(ruta) > UMBRAL_STREAMING:
+            cargar_streaming(ruta, nombre)
+            continue
+
+        try:
+            df, extra, desde_cache, _ = _leer_con_tiempo(ruta, formato)
+            csvs[nombre] = {"df": df, "ruta": ruta, "formato": formato, **extra}
+            print(f"✅ {nombre} ({formato}) cargado correctamente{' (caché)' if desde_cache else ''}.")
         except Exception as e:
             print(f"⚠️ Error al cargar {ruta}: {e}")
 
@@ -66,17 +1105,30 @@ def guardar_archivo(nombre):
     if nombre not in csvs:
         print(f"❌ No se encontró el archivo: {nombre}")
         return
+    if es_streaming(nombre):
+        # Las tablas en streaming se leen directo del archivo, no hay nada que guardar
+        return
     df = csvs[nombre]["df"]
     ruta = csvs[nombre]["ruta"]
     formato = csvs[nombre]["formato"]
 
     try:
         if formato == "csv":
-            df.to_csv(ruta, index=False)
+            encoding = csvs[nombre].get("encoding", "utf-8")
+            sep = csvs[nombre].get("sep", ",")
+            df.to_csv(ruta, index=False, encoding=encoding, sep=sep)
         elif formato == "json":
             df.to_json(ruta, orient="records", indent=2)
         elif formato == "xml":
             df.to_xml(ruta, index=False)
+        # La copia en caché quedó vieja y el journal ya está incluido en el archivo
+        borrar_cache(ruta)
+        if os.path.exists(_ruta_journal(ruta)):
+            os.remove(_ruta_journal(ruta))
+        csvs[nombre]["journal"] = 0
+        # El cubo sigue valiendo, pero su copia en disco apuntaba al archivo anterior
+        if nombre in TABLAS_CUBO:
+            guardar_cubo()
         print(f"✅ Cambios guardados en {ruta}")
     except Exception as e:
         print(f"❌ Error al guardar {nombre}: {e}")
@@ -89,7 +1141,7 @@ def get_csvs_requeridos(*rutas_o_nombres):
         if nombre not in csvs:
             print(f"❌ Falta el archivo: {nombre}")
             return None
-        dfs.append(csvs[nombre]["df"])
+        dfs.append(obtener_df(nombre))
     return dfs
 
 #-----------------
@@ -103,8 +1155,8 @@ def check_csv():
     try:
         idx = int(input("Elige el número del archivo: ")) - 1
         nombre = list(csvs.keys())[idx]
-        df = csvs[nombre]["df"]
-        print(df)
+        for parte in iterar_tabla(nombre):
+            print(parte)
     except (ValueError, IndexError):
         print("Opción inválida.")
 
@@ -119,9 +1171,17 @@ def modify_csv():
     try:
         idx = int(input("Elige el número del archivo: ")) - 1
         nombre = list(csvs.keys())[idx]
+        if es_streaming(nombre):
+            print(f"❌ {nombre} está en modo streaming (solo lectura).")
+            return
         df = csvs[nombre]["df"]
         print("Columnas disponibles:", list(df.columns))
-        fila = int(input("Número de fila a modificar: "))
+        pk = clave_primaria(nombre)
+        id_ = input(f"{pk} de la fila a modificar (vacío para usar número de fila): ").strip() if pk else ""
+        if id_:
+            fila = posiciones_por_id(nombre, [id_])[0]
+        else:
+            fila = int(input("Número de fila a modificar: "))
         if fila < 0 or fila >= len(df):
             print("Fila inválida.")
             return
@@ -130,9 +1190,10 @@ def modify_csv():
             print("Columna inválida.")
             return
         nuevo_valor = input("Nuevo valor: ")
-        df.at[fila, columna] = nuevo_valor
-        guardar_archivo(nombre)
-        csvs[nombre]["df"] = df
+        editar_tabla(nombre, [{"op": "modificar", "fila": fila, "columna": columna, "valor": nuevo_valor}])
+        print("✅ Cambio registrado.")
+    except KeyError as e:
+        print(f"❌ {e.args[0]}")
     except (ValueError, IndexError):
         print("Entrada inválida.")
 
@@ -147,15 +1208,23 @@ def add_row_csv():
     try:
         idx = int(input("Elige el número del archivo: ")) - 1
         nombre = list(csvs.keys())[idx]
+        if es_streaming(nombre):
+            print(f"❌ {nombre} está en modo streaming (solo lectura).")
+            return
         df = csvs[nombre]["df"]
         print("Columnas disponibles:", list(df.columns))
+        pk = clave_primaria(nombre)
         nueva_fila = {}
         for col in df.columns:
+            if col == pk:
+                continue
             valor = input(f"Ingrese valor para '{col}': ")
             nueva_fila[col] = valor
-        df = pd.concat([df, pd.DataFrame([nueva_fila])], ignore_index=True)
-        csvs[nombre]["df"] = df
-        guardar_archivo(nombre)
+        if pk:
+            # id autoincremental
+            nueva_fila[pk] = reservar_ids(nombre)[0]
+            print(f"🔑 {pk} = {nueva_fila[pk]}")
+        editar_tabla(nombre, [{"op": "agregar", "filas": [nueva_fila]}])
         print("✅ Nueva fila añadida y guardada.")
     except (ValueError, IndexError):
         print("Entrada inválida.")
@@ -171,16 +1240,26 @@ def delete_row_csv():
     try:
         idx = int(input("Elige el número del archivo: ")) - 1
         nombre = list(csvs.keys())[idx]
+        if es_streaming(nombre):
+            print(f"❌ {nombre} está en modo streaming (solo lectura).")
+            return
         df = csvs[nombre]["df"]
         print(df.head())
+        pk = clave_primaria(nombre)
+        ids = input(f"{pk} a eliminar, separados por coma (vacío para usar número de fila): ").strip() if pk else ""
+        if ids:
+            ids = [i.strip() for i in ids.split(",") if i.strip()]
+            eliminar_por_ids(nombre, ids)
+            print(f"✅ {len(ids)} filas eliminadas.")
+            return
         fila = int(input("Número de fila a eliminar (0 es la primera): "))
         if fila < 0 or fila >= len(df):
             print("❌ Fila inválida.")
             return
-        df = df.drop(fila).reset_index(drop=True)
-        csvs[nombre]["df"] = df
-        guardar_archivo(nombre)
+        editar_tabla(nombre, [{"op": "eliminar", "filas": [fila]}])
         print(f"✅ Fila {fila} eliminada.")
+    except KeyError as e:
+        print(f"❌ {e.args[0]}")
     except (ValueError, IndexError):
         print("Entrada inválida.")
 
@@ -190,17 +1269,552 @@ def save_all_csvs():
         guardar_archivo(nombre)
 
 #-----------------
-def upload_to_sql(nombre=None):
+# Subida a SQL en bloque. Cada tabla se carga en una transacción sobre una tabla auxiliar
+# (<nombre>__carga) que al final reemplaza a la original: si algo falla, la original queda
+# como estaba (en MySQL DROP/CREATE confirman solos la transacción, por eso no alcanza con ella).
+#   "lotes":   executemany de a `lote` filas (pymysql lo arma como INSERT de muchas filas;
+#              es más rápido que method="multi" de pandas, que compila una sentencia por lote)
+#   "archivo": cada parte se escribe a un CSV temporal y se carga con LOAD DATA LOCAL INFILE
+#              (solo MySQL, con local_infile habilitado en el servidor; en otras bases se usa "lotes")
+METODO_CARGA = "lotes"
+LOTE_CARGA = 5000
+# Varias tablas se suben a la vez, cada una con su conexión del pool (ver CONFIG_DB).
+# Las tablas auxiliares no tienen claves foráneas, así que la base no exige un orden; el
+# orden sale de las claves foráneas del esquema para no dejar datos a medias: una tabla
+# espera a que terminen sus padres (los que están entre las que se suben) y si falla un
+# padre sus hijas no se suben (quedarían apuntando a claves que en la base no están).
+HILOS_CARGA = 4
+
+_ultima_carga = {}
+
+# Padres de cada tabla entre las que se suben: {nombre: {padres}}
+def padres_carga(nombres):
+    return {n: {ref for _, ref, _ in esquema().get(n, {}).get("fk", []) if ref in nombres and ref != n}
+            for n in nombres}
+
+# Niveles de carga: el primero no depende de ninguna, el segundo solo de tablas del primero, etc.
+def orden_carga(nombres):
+    padres = padres_carga(nombres)
+    niveles, hechas = [], set()
+    while len(hechas) < len(padres):
+        nivel = [n for n in padres if n not in hechas and padres[n] <= hechas]
+        if not nivel:
+            raise ValueError(f"Claves foráneas circulares entre: {', '.join(n for n in padres if n not in hechas)}")
+        niveles.append(nivel)
+        hechas.update(nivel)
+    return niveles
+
+# Devuelve {nombre: (filas, segundos)} de las tablas que se pudieron subir
+def upload_to_sql(nombre=None, metodo=None, lote=None, hilos=None, indices_despues=None):
     if not csvs:
         print("No hay archivos cargados.")
-        return
-    dfs = {nombre: csvs[nombre]} if nombre else csvs
-    for n, datos in dfs.items():
+        return {}
+    metodo, lote = metodo or METODO_CARGA, lote or LOTE_CARGA
+    nombres = [nombre] if nombre else list(csvs)
+    niveles = orden_carga(nombres)
+    padres = padres_carga(nombres)
+    motor = obtener_engine()
+    hilos = min(hilos or HILOS_CARGA, len(nombres), CONFIG_DB["pool_size"] + CONFIG_DB["max_overflow"])
+    if motor.dialect.name == "sqlite":
+        hilos = 1  # SQLite admite un solo escritor a la vez
+    resultados, fallidas = {}, set()
+    pendientes, en_curso = [n for nivel in niveles for n in nivel], {}
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(hilos, 1)) as pool:
+        while pendientes or en_curso:
+            for n in list(pendientes):
+                if padres[n] & fallidas:
+                    print(f"❌ No se sube {n}: falló {', '.join(sorted(padres[n] & fallidas))}")
+                    fallidas.add(n)
+                    pendientes.remove(n)
+                elif padres[n] <= resultados.keys():
+                    en_curso[pool.submit(cargar_tabla_sql, n, metodo, lote, motor, indices_despues)] = n
+                    pendientes.remove(n)
+            terminadas, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in terminadas:
+                n = en_curso.pop(futuro)
+                try:
+                    filas, segundos = futuro.result()
+                    print(f"✅ {n} subido a SQL: {filas} filas en {segundos:.2f}s ({filas / max(segundos, 1e-9):,.0f} filas/s)")
+                    resultados[n] = (filas, segundos)
+                except Exception as e:
+                    print(f"❌ No se pudo subir {n}: {e}")
+                    fallidas.add(n)
+    total = time.perf_counter() - inicio
+    filas = sum(f for f, _ in resultados.values())
+    _ultima_carga.clear()
+    _ultima_carga.update(tablas=len(resultados), filas=filas, segundos=total, hilos=hilos,
+                         niveles={n: i for i, nivel in enumerate(niveles) for n in nivel})
+    print(f"📦 {len(resultados)} tablas, {filas} filas en {total:.2f}s ({filas / max(total, 1e-9):,.0f} filas/s, {hilos} hilos)")
+    return resultados
+
+def ultima_carga():
+    return dict(_ultima_carga)
+
+def cargar_tabla_sql(nombre, metodo=METODO_CARGA, lote=LOTE_CARGA, motor=None, indices_despues=None):
+    motor = motor or obtener_engine()
+    indices_despues = INDICES_DESPUES_CARGA if indices_despues is None else indices_despues
+    con_esquema = CREAR_CON_ESQUEMA and esquema_tabla(nombre) is not None
+    if metodo == "archivo" and motor.dialect.name != "mysql":
+        print(f"⚠️ LOAD DATA es solo para MySQL: {nombre} se sube con INSERT de a {lote} filas")
+        metodo = "lotes"
+    if metodo == "archivo":
+        motor = _motor_archivo(motor)
+    inicio = time.perf_counter()
+    filas = 0
+    auxiliar = f"{nombre}__carga"
+    version = version_tabla(nombre)
+    pk = clave_primaria(nombre)
+    huellas = []  # para que la próxima sincronización solo mande los cambios
+    try:
+        with motor.begin() as conexion:
+            # En streaming se sube parte por parte
+            for i, parte in enumerate(iterar_tabla(nombre)):
+                if i == 0 and con_esquema:
+                    conexion.exec_driver_sql(f"DROP TABLE IF EXISTS {_nombre_sql(motor, auxiliar)}")
+                    conexion.exec_driver_sql(ddl_tabla(motor, nombre, auxiliar, parte))
+                    if not indices_despues and indices_en_auxiliar(motor):
+                        crear_indices(conexion, motor, nombre, auxiliar, parte.columns)
+                si_existe = 'replace' if i == 0 and not con_esquema else 'append'
+                if metodo == "archivo":
+                    parte.head(0).to_sql(auxiliar, con=conexion, if_exists=si_existe, index=False)
+                    _load_data(conexion, auxiliar, parte)
+                else:
+                    parte.to_sql(auxiliar, con=conexion, if_exists=si_existe, index=False, chunksize=lote)
+                if pk is not None:
+                    huellas.append(huellas_filas(parte, pk))
+                filas += len(parte)
+            if con_esquema and indices_despues and indices_en_auxiliar(motor):
+                crear_indices(conexion, motor, nombre, auxiliar, columnas_tabla(nombre))
+        indices = con_esquema and not indices_en_auxiliar(motor)
+        _reemplazar_tabla(motor, auxiliar, nombre, columnas_tabla(nombre) if indices else None)
+    except Exception:
+        with motor.begin() as conexion:
+            conexion.exec_driver_sql(f"DROP TABLE IF EXISTS {_nombre_sql(motor, auxiliar)}")
+        raise
+    if pk is not None:
+        _guardar_foto_sync(motor, nombre, _unir_huellas(huellas), version)
+    return filas, time.perf_counter() - inicio
+
+def _nombre_sql(motor, nombre):
+    return motor.dialect.identifier_preparer.quote(nombre)
+
+# Con columnas_indices, los índices del esquema se arman en la misma transacción, sobre la tabla final
+def _reemplazar_tabla(motor, nueva, nombre, columnas_indices=None):
+    nueva_sql, nombre_sql = _nombre_sql(motor, nueva), _nombre_sql(motor, nombre)
+    with motor.begin() as conexion:
+        if motor.dialect.name == "mysql":
+            # InnoDB actualiza las claves foráneas de las hijas cuando se renombra el padre:
+            # renombrar la tabla vieja las dejaría apuntando a una tabla que después se borra.
+            # Por eso se borra la vieja y recién ahí se renombra la nueva: las claves foráneas
+            # de las hijas se vuelven a resolver por nombre contra la tabla nueva. Con las claves
+            # foráneas activas el DROP de un padre falla, así que se apagan solo en esta
+            # conexión y solo para el cambio (la tabla falta un instante entre los dos pasos)
+            conexion.exec_driver_sql("SET FOREIGN_KEY_CHECKS = 0")
+            try:
+                conexion.exec_driver_sql(f"DROP TABLE IF EXISTS {nombre_sql}")
+                conexion.exec_driver_sql(f"RENAME TABLE {nueva_sql} TO {nombre_sql}")
+            finally:
+                conexion.exec_driver_sql("SET FOREIGN_KEY_CHECKS = 1")
+        else:
+            conexion.exec_driver_sql(f"DROP TABLE IF EXISTS {nombre_sql}")
+            conexion.exec_driver_sql(f"ALTER TABLE {nueva_sql} RENAME TO {nombre_sql}")
+        if columnas_indices is not None:
+            crear_indices(conexion, motor, nombre, nombre, columnas_indices)
+
+# El cliente también tiene que aceptar LOAD DATA LOCAL: motor aparte con local_infile
+_motores_archivo = {}
+
+def _motor_archivo(motor):
+    clave = motor.url.render_as_string(hide_password=False)
+    with _lock_engine:
+        if clave not in _motores_archivo:
+            _motores_archivo[clave] = sqlalchemy.create_engine(motor.url, connect_args={"local_infile": True},
+                                                               **_opciones_pool(clave))
+        return _motores_archivo[clave]
+
+def _load_data(conexion, nombre, parte):
+    # Sin ESCAPED BY la palabra NULL sin comillas se lee como nulo
+    parte = parte.astype({c: "Int8" for c in parte.columns if pd.api.types.is_bool_dtype(parte[c])})
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, encoding="utf-8", newline="") as f:
+        parte.to_csv(f, index=False, header=False, na_rep="NULL", lineterminator="\n")
+        ruta = f.name
+    try:
+        columnas = ", ".join(f"`{c}`" for c in parte.columns)
+        conexion.exec_driver_sql(
+            f"LOAD DATA LOCAL INFILE '{ruta.replace(os.sep, '/')}' INTO TABLE `{nombre}` CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+            f"LINES TERMINATED BY '\\n' ({columnas})"
+        )
+    finally:
+        os.remove(ruta)
+
+#-----------------
+# Las tablas se crean con lo declarado en prueba3.sql (tipos, NOT NULL, clave primaria e
+# índices) en vez de dejar que to_sql infiera TEXT/BIGINT sin claves ni índices. Las columnas
+# que no están en el esquema usan el tipo de su dtype. Las claves foráneas no se crean:
+# cada tabla se reemplaza entera y en paralelo con las demás (ver upload_to_sql).
+# Con INDICES_DESPUES_CARGA los índices secundarios se arman al final, en una pasada
+# sobre la tabla llena, en vez de actualizarlos con cada lote insertado. Fuera de MySQL
+# siempre se arman al final, en el reemplazo (ver crear_indices).
+CREAR_CON_ESQUEMA = True
+INDICES_DESPUES_CARGA = True
+
+def _tipo_sql(motor, serie):
+    if pd.api.types.is_bool_dtype(serie):
+        tipo = sqlalchemy.Boolean()
+    elif pd.api.types.is_integer_dtype(serie):
+        tipo = sqlalchemy.BigInteger()
+    elif pd.api.types.is_float_dtype(serie):
+        tipo = sqlalchemy.Float(53)
+    elif pd.api.types.is_datetime64_any_dtype(serie):
+        tipo = sqlalchemy.DateTime()
+    else:
+        tipo = sqlalchemy.Text()
+    return tipo.compile(dialect=motor.dialect)
+
+def ddl_tabla(motor, nombre, destino, parte):
+    tabla = esquema_tabla(nombre)
+    definiciones = []
+    for col in parte.columns:
+        tipo = tabla["definiciones"].get(col)
+        if tipo is None:
+            tipo = _tipo_sql(motor, parte[col])
+        elif motor.dialect.name != "mysql":
+            # Sin lo propio de MySQL: ancho de los int y juego de caracteres
+            tipo = re.sub(r"\b(tinyint|smallint|int|bigint)\(\d+\)", r"\1", tipo)
+            tipo = re.sub(r"\s+(COLLATE|CHARACTER SET)\s+\w+", "", tipo)
+        definiciones.append(f"{_nombre_sql(motor, col)} {tipo}")
+    pk = tabla["pk"] if tabla["pk"] and all(c in parte.columns for c in tabla["pk"]) else []
+    opciones = ""
+    # AUTO_INCREMENT va en la clave primaria (en MySQL tiene que ser clave); cada base lo escribe distinto
+    auto = tabla.get("columna_auto")
+    if auto is not None and pk == [auto]:
+        i = list(parte.columns).index(auto)
+        if motor.dialect.name == "mysql":
+            definiciones[i] += " AUTO_INCREMENT"
+            if "auto_increment" in tabla:
+                opciones = f" AUTO_INCREMENT={tabla['auto_increment']}"
+        elif motor.dialect.name == "sqlite":
+            # Solo INTEGER PRIMARY KEY declarado en la columna acepta AUTOINCREMENT
+            definiciones[i] = f"{_nombre_sql(motor, auto)} INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT"
+            pk = []
+        elif motor.dialect.name == "postgresql":
+            definiciones[i] += " GENERATED BY DEFAULT AS IDENTITY"
+    if pk:
+        definiciones.append(f"PRIMARY KEY ({', '.join(_nombre_sql(motor, c) for c in pk)})")
+    return f"CREATE TABLE {_nombre_sql(motor, destino)} (\n  " + ",\n  ".join(definiciones) + "\n)" + opciones
+
+# En MySQL el nombre de un índice es por tabla (se usa el declarado) y se arman en la tabla
+# auxiliar. En otras bases es global y se le antepone el de la tabla: mientras la tabla vieja
+# exista el nombre está ocupado, así que se arman en el reemplazo, ya sobre la tabla final
+def indices_en_auxiliar(motor):
+    return motor.dialect.name == "mysql"
+
+def crear_indices(conexion, motor, nombre, destino, columnas):
+    for indice, cols, unico in esquema_tabla(nombre)["indices"]:
+        if not all(c in columnas for c in cols):
+            continue
+        if motor.dialect.name != "mysql":
+            indice = f"{nombre}_{indice}"
+        conexion.exec_driver_sql(
+            f"CREATE {'UNIQUE ' if unico else ''}INDEX {_nombre_sql(motor, indice)} ON {_nombre_sql(motor, destino)} "
+            f"({', '.join(_nombre_sql(motor, c) for c in cols)})"
+        )
+
+# Diferencias entre la tabla de la base y el esquema declarado: [texto]
+def verificar_tabla_sql(nombre, motor=None):
+    inspector = sqlalchemy.inspect(motor or obtener_engine())
+    if not inspector.has_table(nombre):
+        return ["no está en la base"]
+    tabla = esquema_tabla(nombre)
+    if tabla is None:
+        return []
+    columnas = columnas_tabla(nombre)
+    en_base = {c["name"] for c in inspector.get_columns(nombre)}
+    diferencias = [f"falta la columna {c}" for c in columnas if c not in en_base]
+    pk = tabla["pk"] if all(c in columnas for c in tabla["pk"]) else []
+    if pk and inspector.get_pk_constraint(nombre).get("constrained_columns") != pk:
+        diferencias.append(f"no tiene la clave primaria ({', '.join(pk)})")
+    indexadas = [i["column_names"] for i in inspector.get_indexes(nombre)]
+    for indice, cols, _ in tabla["indices"]:
+        if all(c in columnas for c in cols) and not any(ix[:len(cols)] == cols for ix in indexadas):
+            diferencias.append(f"falta el índice {indice} ({', '.join(cols)})")
+    return diferencias
+
+#-----------------
+# Sincronización incremental con la base: en vez de reemplazar la tabla se mandan solo
+# las filas nuevas, modificadas y borradas desde la última sincronización (o subida).
+# Se compara un hash de cada fila contra una foto {pk: hash} guardada en DIR_CACHE/sync
+# al terminar la sincronización anterior. Supone que la tabla de la base solo la cambia
+# esta herramienta; con vaciar la caché, la próxima vez se compara contra las claves de la base.
+# Necesita clave primaria (ver clave_primaria); sin ella se sube la tabla entera.
+_sincronizadas = {}  # (base, tabla) -> (versión, filas) de la última sincronización en esta sesión
+
+# El hash no depende del dtype: una columna int que pasa a float o a Int32 al agregar
+# una fila con nulos no marca todas las filas como modificadas
+def huellas_filas(parte, pk):
+    comparable = pd.DataFrame({c: _columna_comparable(parte[c]) for c in parte.columns})
+    return pd.DataFrame({
+        "pk": parte[pk].to_numpy(),
+        "huella": pd.array(pd.util.hash_pandas_object(comparable, index=False).to_numpy(), dtype="UInt64"),
+    })
+
+def _columna_comparable(serie):
+    if pd.api.types.is_numeric_dtype(serie):  # incluye bool
+        return serie.astype("float64")
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.astype("datetime64[ns]")
+    return serie
+
+def _unir_huellas(huellas):
+    if not huellas:
+        return pd.DataFrame({"pk": [], "huella": pd.array([], dtype="UInt64")})
+    return pd.concat(huellas, ignore_index=True)
+
+def _clave_base(motor):
+    return motor.url.render_as_string(hide_password=True)
+
+def _ruta_foto_sync(motor, nombre):
+    base = hashlib.sha1(_clave_base(motor).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(DIR_CACHE, "sync", f"{base}_{nombre}.parquet" if FORMATO_CACHE == "parquet" else f"{base}_{nombre}.pkl")
+
+def _leer_foto_sync(motor, nombre):
+    ruta = _ruta_foto_sync(motor, nombre)
+    try:
+        foto = pd.read_parquet(ruta) if ruta.endswith(".parquet") else pd.read_pickle(ruta)
+    except Exception:
+        return None
+    return foto.astype({"huella": "UInt64"})
+
+def _guardar_foto_sync(motor, nombre, huellas, version):
+    ruta = _ruta_foto_sync(motor, nombre)
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        if ruta.endswith(".parquet"):
+            huellas.to_parquet(ruta + ".tmp", index=False)
+        else:
+            huellas.to_pickle(ruta + ".tmp")
+        os.replace(ruta + ".tmp", ruta)
+        _sincronizadas[(_clave_base(motor), nombre)] = (version, len(huellas))
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar la foto de sincronización de {nombre}: {e}")
+
+def _registros(df):
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+# Devuelve {nombre: {"nuevas", "modificadas", "eliminadas", "sin_cambios", "segundos"}}
+def sincronizar_sql(nombre=None, lote=None, motor=None):
+    if not csvs:
+        print("No hay archivos cargados.")
+        return {}
+    motor, lote = motor or obtener_engine(), lote or LOTE_CARGA
+    nombres = [nombre] if nombre else [n for nivel in orden_carga(list(csvs)) for n in nivel]
+    # Las bajas van de hijas a padres y las altas de padres a hijas: no se borra un padre
+    # que todavía tiene hijas ni se manda una fila que apunta a una clave que no está
+    planes = {}
+    for n in nombres:
+        try:
+            planes[n] = _planear_sync(n, lote, motor)
+        except Exception as e:
+            print(f"❌ No se pudo sincronizar {n}: {e}")
+    for n in reversed(list(planes)):
+        try:
+            _borrar_sync(planes[n], lote, motor)
+        except Exception as e:
+            print(f"❌ No se pudo sincronizar {n}: {e}")
+            del planes[n]
+    resultados = {}
+    for n, plan in planes.items():
         try:
-            datos["df"].to_sql(n, con=engine, if_exists='replace', index=False)
-            print(f"✅ {n} subido a SQL")
+            resultado = _escribir_sync(plan, lote, motor)
         except Exception as e:
-            print(f"❌ No se pudo subir {n}: {e}")
+            print(f"❌ No se pudo sincronizar {n}: {e}")
+            continue
+        resultados[n] = resultado
+        print(f"✅ {n} sincronizada: {resultado['nuevas']} nuevas, {resultado['modificadas']} modificadas, "
+              f"{resultado['eliminadas']} eliminadas, {resultado['sin_cambios']} sin cambios "
+              f"({resultado['segundos'] * 1000:.0f} ms)")
+    return resultados
+
+def sincronizar_tabla_sql(nombre, lote=LOTE_CARGA, motor=None):
+    motor = motor or obtener_engine()
+    plan = _planear_sync(nombre, lote, motor)
+    _borrar_sync(plan, lote, motor)
+    return _escribir_sync(plan, lote, motor)
+
+# Compara la tabla con la foto de la última sincronización. Si hay que subirla entera
+# (sin clave primaria o sin tabla en la base) la sube acá y el plan ya trae el resultado.
+def _planear_sync(nombre, lote, motor):
+    inicio = time.perf_counter()
+    version = version_tabla(nombre)
+    pk = clave_primaria(nombre)
+    existe = sqlalchemy.inspect(motor).has_table(nombre)
+    if existe:
+        for diferencia in verificar_tabla_sql(nombre, motor):
+            print(f"⚠️ {nombre}: {diferencia} (upload_to_sql la vuelve a crear con el esquema)")
+    if pk is None or not existe:
+        if pk is None:
+            print(f"⚠️ {nombre} no tiene clave primaria: se sube entera")
+        filas, _ = cargar_tabla_sql(nombre, lote=lote, motor=motor)
+        return {"resultado": {"nuevas": filas, "modificadas": 0, "eliminadas": 0, "sin_cambios": 0,
+                              "segundos": time.perf_counter() - inicio}}
+
+    # Nada cambió desde la última sincronización de esta sesión
+    anterior = _sincronizadas.get((_clave_base(motor), nombre))
+    if anterior is not None and anterior[0] == version and os.path.exists(_ruta_foto_sync(motor, nombre)):
+        return {"resultado": {"nuevas": 0, "modificadas": 0, "eliminadas": 0, "sin_cambios": anterior[1],
+                              "segundos": time.perf_counter() - inicio}}
+
+    actual = _unir_huellas([huellas_filas(parte, pk) for parte in iterar_tabla(nombre)])
+    if actual["pk"].duplicated().any():
+        raise ValueError(f"{nombre}.{pk} tiene valores repetidos")
+    previa = _leer_foto_sync(motor, nombre)
+    if previa is None:
+        # Sin foto: se compara contra las claves que ya están en la base (todas se actualizan)
+        with motor.connect() as conexion:
+            claves = pd.read_sql(f"SELECT {_nombre_sql(motor, pk)} FROM {_nombre_sql(motor, nombre)}", conexion)[pk]
+        previa = pd.DataFrame({"pk": claves.to_numpy(), "huella": pd.array([None] * len(claves), dtype="UInt64")})
+    comparacion = pd.merge(actual, previa, on="pk", how="outer", suffixes=("", "_previa"), indicator=True)
+    nuevas = set(comparacion.loc[comparacion["_merge"] == "left_only", "pk"])
+    eliminadas = list(comparacion.loc[comparacion["_merge"] == "right_only", "pk"])
+    ambas = comparacion[comparacion["_merge"] == "both"]
+    iguales = (ambas["huella"] == ambas["huella_previa"]).fillna(False).to_numpy(dtype=bool)
+    modificadas = set(ambas.loc[~iguales, "pk"])
+    return {"nombre": nombre, "pk": pk, "version": version, "actual": actual, "nuevas": nuevas,
+            "modificadas": modificadas, "eliminadas": eliminadas, "sin_cambios": int(iguales.sum()),
+            "segundos": time.perf_counter() - inicio}
+
+def _borrar_sync(plan, lote, motor):
+    if "resultado" in plan or not plan["eliminadas"]:
+        return
+    inicio = time.perf_counter()
+    nombre, pk, eliminadas = plan["nombre"], plan["pk"], plan["eliminadas"]
+    with motor.begin() as conexion:
+        tabla = sqlalchemy.Table(nombre, sqlalchemy.MetaData(), autoload_with=conexion)
+        for i in range(0, len(eliminadas), lote):
+            conexion.execute(tabla.delete().where(tabla.c[pk].in_(eliminadas[i:i + lote])))
+    plan["segundos"] += time.perf_counter() - inicio
+
+# Manda las altas y modificaciones y guarda la foto nueva
+def _escribir_sync(plan, lote, motor):
+    if "resultado" in plan:
+        return plan["resultado"]
+    inicio = time.perf_counter()
+    nombre, pk, nuevas, modificadas = plan["nombre"], plan["pk"], plan["nuevas"], plan["modificadas"]
+    with motor.begin() as conexion:
+        tabla = sqlalchemy.Table(nombre, sqlalchemy.MetaData(), autoload_with=conexion)
+        columnas = [c for c in columnas_tabla(nombre) if c in tabla.c]
+        faltan = [c for c in columnas_tabla(nombre) if c not in tabla.c]
+        if faltan:
+            print(f"⚠️ Columnas que no están en la tabla de la base (no se sincronizan): {', '.join(faltan)}")
+        if nuevas or modificadas:
+            # MySQL con la clave primaria declarada: un solo INSERT ... ON DUPLICATE KEY UPDATE
+            upsert = (motor.dialect.name == "mysql"
+                      and sqlalchemy.inspect(conexion).get_pk_constraint(nombre).get("constrained_columns") == [pk])
+            if upsert:
+                sentencia = insert_mysql(tabla)
+                sentencia = sentencia.on_duplicate_key_update({c: sentencia.inserted[c] for c in columnas if c != pk})
+            actualizar = tabla.update().where(tabla.c[pk] == sqlalchemy.bindparam("clave_")).values(
+                {c: sqlalchemy.bindparam(f"nuevo_{c}") for c in columnas if c != pk})
+            for parte in iterar_tabla(nombre, columnas):
+                tocadas = parte[parte[pk].isin(nuevas | modificadas)]
+                if tocadas.empty:
+                    continue
+                for i in range(0, len(tocadas), lote):
+                    bloque = tocadas.iloc[i:i + lote]
+                    if upsert:
+                        conexion.execute(sentencia, _registros(bloque))
+                        continue
+                    altas = bloque[bloque[pk].isin(nuevas)]
+                    cambios = bloque[~bloque[pk].isin(nuevas)]
+                    if len(altas):
+                        conexion.execute(tabla.insert(), _registros(altas))
+                    if len(cambios):
+                        conexion.execute(actualizar, [
+                            {"clave_": r[pk], **{f"nuevo_{c}": v for c, v in r.items() if c != pk}}
+                            for r in _registros(cambios)
+                        ])
+    _guardar_foto_sync(motor, nombre, plan["actual"], plan["version"])
+    return {"nuevas": len(nuevas), "modificadas": len(modificadas), "eliminadas": len(plan["eliminadas"]),
+            "sin_cambios": plan["sin_cambios"], "segundos": plan["segundos"] + time.perf_counter() - inicio}
+
+#-----------------
+# Traer tablas (o consultas) de la base al registro
+# La consulta corre con un cursor del lado del servidor (stream_results) y se lee de a
+# chunksize filas. columnas y donde van en el SELECT: la base filtra y solo viaja lo pedido.
+#   cargar_desde_sql("facturas_enc", donde="fecha >= :desde", parametros={"desde": "2024-05-01"})
+# Cada parte se agrega a ruta (por defecto DIR_CACHE/sql/<nombre>.csv), que queda como archivo
+# base de la tabla para el journal y guardar_archivo(). Si ruta ya existe o es el archivo de
+# una tabla cargada no se pisa, salvo con sobrescribir=True. Con streaming=True la tabla se
+# registra en modo streaming sobre ese archivo y nunca se junta entera en memoria.
+def tablas_sql(motor=None):
+    return sqlalchemy.inspect(motor or obtener_engine()).get_table_names()
+
+def _select_sql(motor, tabla, consulta, columnas, donde):
+    origen = _nombre_sql(motor, tabla) if consulta is None else f"({consulta}) AS consulta"
+    lista = ", ".join(_nombre_sql(motor, c) for c in columnas) if columnas else "*"
+    return f"SELECT {lista} FROM {origen}" + (f" WHERE {donde}" if donde else "")
+
+# Devuelve (filas, segundos)
+def cargar_desde_sql(tabla=None, consulta=None, nombre=None, columnas=None, donde=None, parametros=None,
+                     chunksize=CHUNKSIZE, streaming=False, ruta=None, motor=None, sobrescribir=False):
+    if (tabla is None) == (consulta is None):
+        raise ValueError("Indicá una tabla o una consulta")
+    nombre = nombre or tabla or "consulta"
+    ruta = ruta or os.path.join(DIR_CACHE, "sql", f"{nombre}.csv")
+    if not sobrescribir:
+        usada = [n for n, d in csvs.items() if os.path.abspath(d["ruta"]) == os.path.abspath(ruta)]
+        if usada:
+            raise ValueError(f"{ruta} es el archivo de {usada[0]}: usá otra ruta o sobrescribir=True")
+        if os.path.exists(ruta):
+            raise ValueError(f"{ruta} ya existe: usá otra ruta o sobrescribir=True")
+    os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+    motor = motor or obtener_engine()
+    texto = _select_sql(motor, tabla, consulta, columnas, donde)
+    inicio = time.perf_counter()
+    partes, filas, escrito = [], 0, False
+    with motor.connect() as conexion:
+        conexion = conexion.execution_options(stream_results=True, max_row_buffer=chunksize)
+        for parte in pd.read_sql(sqlalchemy.text(texto), conexion, params=parametros, chunksize=chunksize):
+            parte.to_csv(ruta, mode="a" if escrito else "w", header=not escrito, index=False)
+            escrito = True
+            filas += len(parte)
+            if not streaming:
+                partes.append(parte)
+    if not escrito:
+        pd.DataFrame(columns=columnas or []).to_csv(ruta, index=False)
+    # La copia en caché, el journal y la secuencia de ids de una tabla anterior con esta ruta ya no valen
+    borrar_cache(ruta)
+    for anterior in (_ruta_journal(ruta), ruta + ".seq"):
+        if os.path.exists(anterior):
+            os.remove(anterior)
+    entrada = {"ruta": ruta, "formato": "csv", "encoding": "utf-8", "sep": ",", "origen": texto, "tabla_sql": tabla}
+    if streaming:
+        csvs[nombre] = {"df": None, **entrada, "chunksize": chunksize}
+    else:
+        # Los tipos del esquema son los de la tabla de origen, aunque se guarde con otro nombre
+        df = aplicar_tipos(tabla or nombre, pd.concat(partes, ignore_index=True) if partes else pd.read_csv(ruta))
+        csvs[nombre] = {"df": df, **entrada, "periodos": calcular_periodos(df)}
+    segundos = time.perf_counter() - inicio
+    print(f"✅ {nombre} traído de la base: {filas} filas en {segundos:.2f}s{' (streaming)' if streaming else ''}")
+    return filas, segundos
+
+#-----------------
+def consulta_sql():
+    if not csvs:
+        print("No hay archivos cargados.")
+        return
+    print("Tablas disponibles:", ", ".join(csvs))
+    consulta = input("Consulta SQL: ").strip()
+    if not consulta:
+        return
+    try:
+        df, segundos = consultar_sql(consulta)
+        print(df)
+        print(f"⏱️ {len(df)} filas en {segundos:.3f}s ({motor_consultas()})")
+    except Exception as e:
+        print(f"❌ Error en la consulta: {e}")
 
 #-----------------
 def unify_tables():
@@ -217,15 +1831,30 @@ def unify_tables():
             print("Debes seleccionar al menos 2 archivos.")
             return
         nombre_base = list(csvs.keys())[indices[0]]
-        merged_df = csvs[nombre_base]["df"]
+        merged_df = obtener_df(nombre_base)
+        unidas = [nombre_base]
         for idx in indices[1:]:
             nombre = list(csvs.keys())[idx]
-            df = csvs[nombre]["df"]
+            df = obtener_df(nombre)
             print(f"\nUniendo {nombre_base} con {nombre}...")
             print("Columnas disponibles en base:", list(merged_df.columns))
             print("Columnas disponibles en", nombre, ":", list(df.columns))
-            key = input("Columna en común para unir: ").strip()
-            merged_df = pd.merge(merged_df, df, on=key, how="left")
+            sugerida = sugerir_clave(unidas, nombre)
+            if sugerida:
+                print(f"🔑 Según las claves foráneas: {', '.join(sugerida[0])}")
+            key = input("Columna en común para unir (vacío para usar la sugerida): ").strip()
+            if key:
+                izq_on = der_on = [key]
+            elif sugerida:
+                izq_on, der_on = sugerida[0], sugerida[1]
+            else:
+                print("❌ No hay clave foránea entre estas tablas, indicá la columna.")
+                return
+            filas = estimar_filas_union(merged_df, df, izq_on, der_on, how="left")
+            print(f"📏 Filas estimadas: {filas}")
+            controlar_union(filas, merged_df, df, f"{nombre_base} con {nombre}")
+            merged_df = _merge(merged_df, df, izq_on, der_on, how="left")
+            unidas.append(nombre)
             nombre_base += f"_{nombre}"
         print("\nResultado:")
         print(merged_df.head())
@@ -239,64 +1868,1248 @@ def unify_tables():
     except Exception as e:
         print(f"Error al unir tablas: {e}")
 
+#-----------------
+# Versiones de las tablas: cambian con cada edición, y cada carga o unión registra una
+# entrada nueva que arranca con otra versión. Sirven para saber si un resultado quedó viejo.
+_versiones = itertools.count(1)
+
+def version_tabla(nombre):
+    datos = csvs[nombre]
+    if "version" not in datos:
+        datos["version"] = next(_versiones)
+    return datos["version"]
+
+def _nueva_version(nombre):
+    csvs[nombre]["version"] = next(_versiones)
+
+# Huella del contenido de una tabla: igual contenido (y tipos) -> igual huella, aunque se
+# cargue en otra sesión. Se calcula una vez por versión; en streaming se usa la firma
+# del archivo y su journal para no recorrerlo entero.
+def huella_tabla(nombre):
+    datos = csvs[nombre]
+    df = datos["df"]
+    if df is None:
+        ruta = datos["ruta"]
+        journal = _ruta_journal(ruta)
+        firmas = [_firma_archivo(ruta), _firma_archivo(journal) if os.path.exists(journal) else None, firma_esquema()]
+        return hashlib.sha1(json.dumps(firmas).encode("utf-8")).hexdigest()
+    version = version_tabla(nombre)
+    guardada = datos.get("huella")
+    if guardada is not None and guardada[0] == version and guardada[1]() is df:
+        return guardada[2]
+    h = hashlib.sha1()
+    h.update(json.dumps([[str(c) for c in df.columns], [str(t) for t in df.dtypes]]).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    datos["huella"] = (version, weakref.ref(df), h.hexdigest())
+    return datos["huella"][2]
+
+#-----------------
+# Uniones ya calculadas (ej: vc), reutilizadas mientras no cambie ninguna tabla de entrada.
+# Se guarda un resultado por unión; si se pasa de MEMORIA_UNIONES se descartan
+# los usados hace más tiempo.
+MEMORIA_UNIONES = 512 * 1024 * 1024  # bytes
+_uniones = OrderedDict()  # nombre: (versiones, df, bytes)
+_lock_uniones = threading.Lock()
+
+def union_memorizada(nombre, tablas, construir):
+    versiones = tuple(version_tabla(t) for t in tablas)
+    with _lock_uniones:
+        guardado = _uniones.get(nombre)
+        if guardado is not None and guardado[0] == versiones:
+            _uniones.move_to_end(nombre)
+            return guardado[1]
+    df = construir()
+    if df is None:
+        return None
+    tamaño = int(df.memory_usage(deep=True).sum())
+    with _lock_uniones:
+        _uniones.pop(nombre, None)
+        if tamaño <= MEMORIA_UNIONES:
+            _uniones[nombre] = (versiones, df, tamaño)
+            while sum(t for _, _, t in _uniones.values()) > MEMORIA_UNIONES:
+                _uniones.popitem(last=False)
+    return df
+
+def limpiar_uniones():
+    with _lock_uniones:
+        _uniones.clear()
+
+#-----------------
+# Planificador de uniones
+# Las columnas y el orden de cada unión salen de las claves foráneas del esquema, y antes
+# de unir se estima cuántas filas va a dar (con las repeticiones de cada valor de la clave).
+# Si una unión multiplica las filas más de FACTOR_MAX_JOIN veces se corta con un error
+# (o solo se avisa, con GUARDIA_JOIN = "aviso").
+FACTOR_MAX_JOIN = 10
+GUARDIA_JOIN = "error"  # "error" | "aviso"
+
+# Claves foráneas entre dos tablas, en cualquier sentido: [(hija, columnas, padre, columnas_padre)]
+def claves_foraneas(a, b):
+    relaciones = []
+    for hija, padre in ((a, b), (b, a)):
+        for columnas, ref, columnas_ref in esquema().get(hija, {}).get("fk", []):
+            if ref == padre:
+                relaciones.append((hija, columnas, padre, columnas_ref))
+    return relaciones
+
+# Columnas para unir la tabla nombre con alguna de las ya unidas: (izq_on, der_on, n_a_1)
+# Se prefieren las relaciones hija -> padre, que no multiplican filas
+def sugerir_clave(unidas, nombre):
+    opciones = []
+    for tabla in unidas:
+        for hija, columnas, padre, columnas_ref in claves_foraneas(tabla, nombre):
+            if hija == tabla:
+                opciones.append((columnas, columnas_ref, True))
+            else:
+                opciones.append((columnas_ref, columnas, False))
+    opciones.sort(key=lambda o: not o[2])
+    return opciones[0] if opciones else None
+
+def _repeticiones(df, columnas):
+    if len(columnas) == 1:
+        return df[columnas[0]].value_counts(dropna=False)
+    return df[columnas].value_counts(dropna=False)
+
+# Filas que daría pd.merge sin hacerlo: suma de (repeticiones izq * repeticiones der) por valor
+# Se unen las tablas de repeticiones (una fila por valor distinto); un valor sin pareja cuenta 1
+def estimar_filas_union(izq, der, izq_on, der_on, how="inner"):
+    a = _repeticiones(izq, izq_on).rename("filas_izq").reset_index()
+    b = _repeticiones(der, der_on).rename("filas_der").reset_index()
+    cuentas = _merge(a, b, izq_on, der_on, how).fillna({"filas_izq": 1, "filas_der": 1})
+    return int((cuentas["filas_izq"] * cuentas["filas_der"]).sum())
+
+def controlar_union(filas, izq, der, descripcion):
+    base = max(len(izq), len(der), 1)
+    if filas > FACTOR_MAX_JOIN * base:
+        mensaje = f"La unión {descripcion} daría {filas} filas ({filas / base:.1f} veces las {base} de entrada)"
+        if GUARDIA_JOIN == "error":
+            raise ValueError(mensaje)
+        print(f"⚠️ {mensaje}")
+
+def _merge(izq, der, izq_on, der_on, how):
+    if izq_on == der_on:
+        return pd.merge(izq, der, on=izq_on, how=how)
+    return pd.merge(izq, der, left_on=izq_on, right_on=der_on, how=how)
+
+# Unir varias tablas (dfs = {nombre: df}) siguiendo las claves foráneas
+# Se arranca por la tabla más grande que no es padre de ninguna otra del grupo (la de hechos)
+# y se van agregando primero los padres y después los hijos, cada vez la que menos filas da.
+# Las tablas sin clave foránea hacia las ya unidas quedan afuera con un aviso.
+def unir_por_fk(dfs, how="left"):
+    nombres = list(dfs)
+    padres = {p for a, b in itertools.permutations(nombres, 2) for _, _, p, _ in claves_foraneas(a, b)}
+    inicio = max([n for n in nombres if n not in padres] or nombres, key=lambda n: len(dfs[n]))
+    df, unidas = dfs[inicio], [inicio]
+    pendientes = [n for n in nombres if n != inicio]
+    while pendientes:
+        opciones = []
+        for n in pendientes:
+            clave = sugerir_clave(unidas, n)
+            if clave:
+                izq_on, der_on, n_a_1 = clave
+                opciones.append((not n_a_1, estimar_filas_union(df, dfs[n], izq_on, der_on, how), n, izq_on, der_on))
+        if not opciones:
+            for n in pendientes:
+                print(f"⚠️ {n} no tiene clave foránea hacia {', '.join(unidas)}: se deja afuera.")
+            break
+        _, filas, n, izq_on, der_on = min(opciones, key=lambda o: o[:3])
+        controlar_union(filas, df, dfs[n], f"{' + '.join(unidas)} con {n} por {', '.join(izq_on)}")
+        df = _merge(df, dfs[n], izq_on, der_on, how)
+        unidas.append(n)
+        pendientes.remove(n)
+    return df
+
 # -------------------------------
-# Función que une ventas, facturas y clientes
+# Función que une facturas (detalle y encabezado) y clientes
+# Una fila por renglón de factura; el orden y las claves los elige unir_por_fk
+# El resultado queda memorizado y se comparte entre reportes: no modificarlo
 # -------------------------------
+TABLAS_VC = ("facturas_det", "facturas_enc", "clientes")
+
 def vc():
-    dfs = get_csvs_requeridos("clientes", "facturas_det", "ventas", "facturas_enc")
+    if all(n in csvs for n in TABLAS_VC):
+        return union_memorizada("vc", TABLAS_VC, _construir_vc)
+    return _construir_vc()
+
+def _construir_vc():
+    dfs = get_csvs_requeridos(*TABLAS_VC)
     if dfs is None:
         print("❌ No se pudieron cargar los DataFrames necesarios.")
         return None
-    clientes, facturas_det, ventas, facturas_enc = dfs
 
     try:
-        df = pd.merge(ventas, facturas_det, on="id_factura", how="inner")
-        df = pd.merge(df, facturas_enc, on="id_sucursal", how="left")
-        df = pd.merge(df, clientes, on="id_cliente", how="left")
-        return df
+        return unir_por_fk(dict(zip(TABLAS_VC, dfs)))
     except Exception as e:
         print(f"❌ Error al unir los datos: {e}")
         return None
 
+# -------------------------------
+# La misma unión pero por partes, para cuando facturas_det está en streaming
+# Devuelve un generador de partes (o None si faltan tablas)
+# -------------------------------
+def vc_partes():
+    faltantes = [n for n in TABLAS_VC if n not in csvs]
+    if faltantes:
+        for n in faltantes:
+            print(f"❌ Falta el archivo: {n}")
+        print("❌ No se pudieron cargar los DataFrames necesarios.")
+        return None
+    if not es_streaming("facturas_det"):
+        df = vc()
+        return None if df is None else iter([df])
+    return _generar_vc_partes()
+
+def _generar_vc_partes():
+    clientes = obtener_df("clientes")
+    facturas_enc = obtener_df("facturas_enc")
+    for facturas_det in iterar_tabla("facturas_det"):
+        yield unir_por_fk({"facturas_det": facturas_det, "facturas_enc": facturas_enc, "clientes": clientes})
+
+# Los totales son de la factura y se repiten en cada renglón: para sumarlos
+# se deja una fila por id_factura (también entre partes distintas)
+def _por_factura(partes):
+    vistas = set()
+    for parte in partes:
+        parte = parte.drop_duplicates("id_factura")
+        parte = parte[~parte["id_factura"].isin(vistas)]
+        vistas.update(parte["id_factura"].tolist())
+        yield parte
+
+#-----------------
+# Cubo de ventas: agregados ya calculados que usan los reportes en vez de recorrer
+# los renglones en cada consulta. Tiene dos niveles:
+#   facturas:  id_cliente x mes x id_sucursal -> total, facturas
+#   renglones: id_cliente x mes x id_producto x id_rubro x id_sucursal -> cantidad, subtotal, renglones
+# mes es año*100+mes (ej: 202405) y una clave que falta queda en -1.
+# Los nombres (clientes, productos, rubros) se agregan recién al consultar, así que
+# editarlos no toca el cubo. Las ediciones de facturas_det, facturas_enc y productos
+# lo actualizan restando las filas viejas y sumando las nuevas, y se guarda en
+# DIR_CACHE para la próxima sesión.
+TABLAS_CUBO = ("facturas_det", "facturas_enc", "productos")
+GRANO_FACTURAS = ["id_cliente", "mes", "id_sucursal"]
+GRANO_RENGLONES = ["id_cliente", "mes", "id_producto", "id_rubro", "id_sucursal"]
+# Columnas que usa el cubo de cada tabla (cambiar las demás no lo afecta)
+COLUMNAS_CUBO = {
+    "facturas_det": ["id_factura", "id_producto", "cantidad", "subtotal"],
+    "facturas_enc": ["id_factura", "fecha", "id_cliente", "id_sucursal", "total"],
+    "productos": ["id_producto", "id_rubro"],
+}
+
+_cubo = None  # {"versiones": (...), "facturas": df, "renglones": df}
+_lock_cubo = threading.RLock()
+
+def _clave(serie):
+    return pd.to_numeric(serie, errors="coerce").fillna(-1).astype("int64")
+
+# Mes como código entero; la tabla entera de facturas_enc ya lo trae precalculado
+def _mes(enc):
+    if "mes" in enc.columns:
+        return enc["mes"].astype("int64")
+    return codigos_periodo(enc["fecha"])["mes"].astype("int64")
+
+# Tabla del registro con solo las columnas del cubo (vacía si no está cargada)
+def _tabla_cubo(nombre):
+    df = obtener_df(nombre) if nombre in csvs else pd.DataFrame()
+    tabla = df.reindex(columns=COLUMNAS_CUBO[nombre])
+    if nombre == "facturas_enc" and "fecha" in df.columns and not es_streaming(nombre):
+        tabla["mes"] = periodos(nombre)["mes"].to_numpy()
+    return tabla
+
+def _agregar_facturas(enc):
+    df = pd.DataFrame({
+        "id_cliente": _clave(enc["id_cliente"]),
+        "mes": _mes(enc),
+        "id_sucursal": _clave(enc["id_sucursal"]),
+        "total": pd.to_numeric(enc["total"], errors="coerce"),
+    })
+    return df.groupby(GRANO_FACTURAS).agg(total=("total", "sum"), facturas=("total", "size"))
+
+def _agregar_renglones(det, enc, productos):
+    det = det.assign(id_factura=_clave(det["id_factura"]), id_producto=_clave(det["id_producto"]))
+    enc = pd.DataFrame({
+        "id_factura": _clave(enc["id_factura"]),
+        "id_cliente": _clave(enc["id_cliente"]),
+        "mes": _mes(enc),
+        "id_sucursal": _clave(enc["id_sucursal"]),
+    })
+    productos = pd.DataFrame({"id_producto": _clave(productos["id_producto"]), "id_rubro": _clave(productos["id_rubro"])})
+    df = pd.merge(det, enc, on="id_factura", how="left")
+    df = pd.merge(df, productos, on="id_producto", how="left")
+    df = pd.DataFrame({
+        **{c: df[c].fillna(-1).astype("int64") for c in GRANO_RENGLONES},
+        "cantidad": pd.to_numeric(df["cantidad"], errors="coerce"),
+        "subtotal": pd.to_numeric(df["subtotal"], errors="coerce"),
+    })
+    return df.groupby(GRANO_RENGLONES).agg(cantidad=("cantidad", "sum"), subtotal=("subtotal", "sum"), renglones=("cantidad", "size"))
+
+# cubo + mas - menos; la última columna cuenta filas y en 0 la celda desaparece
+def _sumar(cubo, mas, menos):
+    total = pd.concat([cubo, mas, -menos]).groupby(level=list(cubo.index.names)).sum()
+    return total[total.iloc[:, -1] != 0]
+
+def _construir_cubo():
+    enc = _tabla_cubo("facturas_enc")
+    productos = _tabla_cubo("productos")
+    if "facturas_det" in csvs:
+        # Por partes, por si facturas_det está en streaming
+        partes = [_agregar_renglones(parte.reindex(columns=COLUMNAS_CUBO["facturas_det"]), enc, productos)
+                  for parte in iterar_tabla("facturas_det")]
+        renglones = pd.concat(partes).groupby(level=GRANO_RENGLONES).sum()
+    else:
+        renglones = _agregar_renglones(_tabla_cubo("facturas_det"), enc, productos)
+    return _agregar_facturas(enc), renglones
+
+def _versiones_cubo():
+    return tuple(version_tabla(n) if n in csvs else None for n in TABLAS_CUBO)
+
+#-----------------
+# Copia del cubo en disco, válida mientras no cambien los archivos (ni sus journals)
+def _ruta_cubo(nivel):
+    return os.path.join(DIR_CACHE, f"cubo_ventas_{nivel}")
+
+def _firmas_cubo():
+    firmas = {}
+    for nombre in TABLAS_CUBO:
+        if nombre not in csvs:
+            firmas[nombre] = None
+            continue
+        ruta = csvs[nombre]["ruta"]
+        journal = _ruta_journal(ruta)
+        try:
+            firmas[nombre] = [_firma_archivo(ruta), _firma_archivo(journal) if os.path.exists(journal) else None]
+        except OSError:
+            return None
+    return firmas
+
+def guardar_cubo():
+    with _lock_cubo:
+        if not USAR_CACHE or _cubo is None or _cubo["versiones"] != _versiones_cubo():
+            return
+        firmas = _firmas_cubo()
+        if firmas is None:
+            return
+        meta = _ruta_cubo("meta") + ".json"
+        try:
+            os.makedirs(DIR_CACHE, exist_ok=True)
+            # Sin el .json la copia no se considera válida: se borra primero y se escribe al final
+            if os.path.exists(meta):
+                os.remove(meta)
+            for nivel in ("facturas", "renglones"):
+                if FORMATO_CACHE == "parquet":
+                    _cubo[nivel].reset_index().to_parquet(_ruta_cubo(nivel) + ".parquet", index=False)
+                else:
+                    _cubo[nivel].reset_index().to_pickle(_ruta_cubo(nivel) + ".pkl")
+            with open(meta, "w", encoding="utf-8") as f:
+                json.dump({"firmas": firmas, "formato_cache": FORMATO_CACHE}, f)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el cubo de ventas: {e}")
+
+def leer_cubo(firmas):
+    try:
+        with open(_ruta_cubo("meta") + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("firmas") != firmas:
+        return None
+    try:
+        niveles = []
+        for nivel, grano in (("facturas", GRANO_FACTURAS), ("renglones", GRANO_RENGLONES)):
+            if meta["formato_cache"] == "parquet":
+                df = pd.read_parquet(_ruta_cubo(nivel) + ".parquet")
+            else:
+                df = pd.read_pickle(_ruta_cubo(nivel) + ".pkl")
+            niveles.append(df.set_index(grano))
+    except Exception:
+        return None
+    return niveles
+
+#-----------------
+# El cubo al día con las tablas cargadas: de memoria, de disco o armado de cero
+def cubo_ventas():
+    global _cubo
+    with _lock_cubo:
+        versiones = _versiones_cubo()
+        if _cubo is not None and _cubo["versiones"] == versiones:
+            return _cubo
+        firmas = _firmas_cubo() if USAR_CACHE else None
+        niveles = leer_cubo(firmas) if firmas else None
+        armado = niveles is None
+        if armado:
+            try:
+                niveles = _construir_cubo()
+            except Exception as e:
+                print(f"❌ No se pudo armar el cubo de ventas: {e}")
+                return None
+        _cubo = {"versiones": versiones, "facturas": niveles[0], "renglones": niveles[1]}
+        if armado:
+            guardar_cubo()
+        return _cubo
+
+#-----------------
+# Actualización del cubo al editar
+# Posiciones que tocan las ops, aplicadas en orden sobre una tabla de `filas` filas:
+# (filas originales modificadas o borradas, filas finales modificadas o agregadas)
+def filas_tocadas(ops, filas):
+    origen = np.arange(filas)
+    tocada = np.zeros(filas, dtype=bool)
+    viejas = set()
+    for op in ops:
+        if op["op"] == "modificar":
+            fila = int(op["fila"])
+            tocada[fila] = True
+            if origen[fila] >= 0:
+                viejas.add(int(origen[fila]))
+        elif op["op"] == "agregar":
+            origen = np.concatenate([origen, np.full(len(op["filas"]), -1)])
+            tocada = np.concatenate([tocada, np.ones(len(op["filas"]), dtype=bool)])
+        elif op["op"] == "eliminar":
+            borrar = [int(fila) for fila in op["filas"]]
+            viejas.update(int(o) for o in origen[borrar] if o >= 0)
+            origen = np.delete(origen, borrar)
+            tocada = np.delete(tocada, borrar)
+    return sorted(viejas), np.flatnonzero(tocada)
+
+# Antes de aplicar las ops: copia de las filas que van a cambiar y posiciones finales tocadas
+# None si la tabla no es del cubo o el cubo no está armado (se arma de cero al usarlo)
+def _filas_previas_cubo(nombre, df, ops):
+    if nombre not in TABLAS_CUBO or _cubo is None:
+        return None
+    if all(op["op"] == "modificar" and op["columna"] not in COLUMNAS_CUBO[nombre] for op in ops):
+        return df.iloc[[]].reindex(columns=COLUMNAS_CUBO[nombre]), []
+    viejas, nuevas = filas_tocadas(ops, len(df))
+    return df.iloc[viejas].reindex(columns=COLUMNAS_CUBO[nombre]), nuevas
+
+def _actualizar_cubo(nombre, df, cambios, version_anterior):
+    global _cubo
+    with _lock_cubo:
+        if cambios is None or _cubo is None:
+            return
+        esperadas = tuple(version_anterior if n == nombre else v for n, v in zip(TABLAS_CUBO, _versiones_cubo()))
+        if _cubo["versiones"] != esperadas:
+            return
+        previas, posiciones = cambios
+        if len(previas) == 0 and len(posiciones) == 0:
+            _cubo["versiones"] = _versiones_cubo()
+            guardar_cubo()
+            return
+        try:
+            nuevas = df.iloc[posiciones].reindex(columns=COLUMNAS_CUBO[nombre])
+            facturas, renglones = _cubo["facturas"], _cubo["renglones"]
+            if nombre == "facturas_det":
+                enc, productos = _tabla_cubo("facturas_enc"), _tabla_cubo("productos")
+                mas = _agregar_renglones(nuevas, enc, productos)
+                menos = _agregar_renglones(previas, enc, productos)
+            else:
+                # Un cambio en una factura o un producto mueve de celda a todos sus renglones:
+                # se restan con la versión vieja de la tabla y se suman con la nueva
+                clave = "id_factura" if nombre == "facturas_enc" else "id_producto"
+                ids = set(_clave(previas[clave])) | set(_clave(nuevas[clave]))
+                actual = df.reindex(columns=COLUMNAS_CUBO[nombre])
+                en_ids = _clave(actual[clave]).isin(ids).to_numpy()
+                sin_tocar = np.ones(len(actual), dtype=bool)
+                sin_tocar[posiciones] = False
+                tabla_nueva = actual[en_ids]
+                tabla_vieja = pd.concat([previas, actual[en_ids & sin_tocar]])
+                det = _tabla_cubo("facturas_det")
+                det = det[_clave(det[clave]).isin(ids)]
+                if nombre == "facturas_enc":
+                    facturas = _sumar(facturas, _agregar_facturas(nuevas), _agregar_facturas(previas))
+                    productos = _tabla_cubo("productos")
+                    mas = _agregar_renglones(det, tabla_nueva, productos)
+                    menos = _agregar_renglones(det, tabla_vieja, productos)
+                else:
+                    enc = _tabla_cubo("facturas_enc")
+                    mas = _agregar_renglones(det, enc, tabla_nueva)
+                    menos = _agregar_renglones(det, enc, tabla_vieja)
+            renglones = _sumar(renglones, mas, menos)
+            _cubo = {"versiones": _versiones_cubo(), "facturas": facturas, "renglones": renglones}
+        except Exception as e:
+            print(f"⚠️ No se pudo actualizar el cubo de ventas ({e}), se vuelve a armar al usarlo.")
+            _cubo = None
+            return
+        guardar_cubo()
+
+#-----------------
+# Planes de consulta: los reportes se describen como un árbol de pasos que no se
+# ejecuta hasta llamar a ejecutar_plan(). Antes de ejecutar, optimizar_plan():
+#   - baja los filtros por debajo de uniones y agrupaciones (se filtra antes de unir)
+#   - lee de cada tabla solo las columnas que se usan más arriba
+#   - junta dos agrupaciones seguidas en una sola (ej: suma de sumas)
+# Cada paso es un dict {"op": ..., ...}, igual que las operaciones del journal.
+# Fuentes: cualquier tabla cargada o los niveles del cubo ("cubo.facturas", "cubo.renglones").
+# Con MOSTRAR_PLANES = True se imprime el plan con el tiempo y las filas de cada paso.
+MOSTRAR_PLANES = False
+FUENTES_CUBO = {
+    "cubo.facturas": ("facturas", GRANO_FACTURAS + ["total", "facturas"]),
+    "cubo.renglones": ("renglones", GRANO_RENGLONES + ["cantidad", "subtotal", "renglones"]),
+}
+OPERADORES_FILTRO = {
+    "==": lambda s, v: s == v, "!=": lambda s, v: s != v,
+    ">": lambda s, v: s > v, ">=": lambda s, v: s >= v,
+    "<": lambda s, v: s < v, "<=": lambda s, v: s <= v,
+    "in": lambda s, v: s.isin(v),
+    "notna": lambda s, v: s.notna(),
+}
+# (agregación de afuera, agregación de adentro) -> agregación equivalente sobre los datos originales
+FUSION_AGREGACIONES = {
+    ("sum", "sum"): "sum", ("sum", "count"): "count", ("sum", "size"): "size",
+    ("min", "min"): "min", ("max", "max"): "max",
+}
+# Cómo se combinan los parciales al agrupar por partes (mean se arma con sum y count)
+COMBINAR_PARCIALES = {"sum": "sum", "count": "sum", "size": "sum", "min": "min", "max": "max"}
+
+# Plan de la última ejecución, por hilo: cada sesión del dashboard ve solo el suyo
+_ultimo_plan = threading.local()
+
+def escanear(tabla, columnas=None):
+    return {"op": "scan", "tabla": tabla, "columnas": columnas}
+
+def filtrar(nodo, columna, operador, valor):
+    if operador not in OPERADORES_FILTRO:
+        raise ValueError(f"Operador de filtro desconocido: {operador}")
+    return {"op": "filtro", "entrada": nodo, "columna": columna, "operador": operador, "valor": valor}
+
+def unir(izq, der, izq_on, der_on=None, how="inner"):
+    izq_on = [izq_on] if isinstance(izq_on, str) else list(izq_on)
+    der_on = izq_on if der_on is None else [der_on] if isinstance(der_on, str) else list(der_on)
+    return {"op": "unir", "izq": izq, "der": der, "izq_on": izq_on, "der_on": der_on, "how": how}
+
+# agregaciones: salida=(columna, función); para "size" la columna puede ser None
+def agrupar(nodo, por, **agregaciones):
+    por = [por] if isinstance(por, str) else list(por)
+    return {"op": "agrupar", "entrada": nodo, "por": por, "agregaciones": agregaciones}
+
+# expresion: función df -> Serie; usa: columnas que necesita
+def calcular_columna(nodo, columna, expresion, usa):
+    return {"op": "calcular", "entrada": nodo, "columna": columna, "expresion": expresion, "usa": list(usa)}
+
+def proyectar(nodo, columnas):
+    return {"op": "proyectar", "entrada": nodo, "columnas": list(columnas)}
+
+def primeros(nodo, columna, k=TOP_K, ascendente=False, desempate=None):
+    return {"op": "primeros", "entrada": nodo, "columna": columna, "k": k, "ascendente": ascendente, "desempate": desempate}
+
+def _hijos(nodo):
+    if nodo["op"] == "unir":
+        return [nodo["izq"], nodo["der"]]
+    return [nodo["entrada"]] if "entrada" in nodo else []
+
+#-----------------
+# Columnas que salen de cada paso (sin ejecutar nada)
+def columnas_plan(nodo):
+    op = nodo["op"]
+    if op == "scan":
+        if nodo["columnas"] is not None:
+            return list(nodo["columnas"])
+        if nodo["tabla"] in FUENTES_CUBO:
+            return list(FUENTES_CUBO[nodo["tabla"]][1])
+        if nodo["tabla"] not in csvs:
+            raise KeyError(f"Falta el archivo: {nodo['tabla']}")
+        return columnas_tabla(nodo["tabla"])
+    if op == "agrupar":
+        return nodo["por"] + list(nodo["agregaciones"])
+    if op == "proyectar":
+        return list(nodo["columnas"])
+    if op == "calcular":
+        return [c for c in columnas_plan(nodo["entrada"]) if c != nodo["columna"]] + [nodo["columna"]]
+    if op == "unir":
+        izq, der = columnas_plan(nodo["izq"]), columnas_plan(nodo["der"])
+        claves = _claves_comunes(nodo)
+        repetidas = (set(izq) & set(der)) - claves
+        return ([f"{c}_x" if c in repetidas else c for c in izq]
+                + [f"{c}_y" if c in repetidas else c for c in der if c not in claves])
+    return columnas_plan(nodo["entrada"])
+
+# Claves con el mismo nombre de los dos lados: pandas deja una sola columna
+def _claves_comunes(nodo):
+    return {i for i, d in zip(nodo["izq_on"], nodo["der_on"]) if i == d}
+
+#-----------------
+# Optimizador
+def optimizar_plan(nodo):
+    return _podar(_reescribir(nodo), None)
+
+def _reescribir(nodo):
+    if nodo["op"] == "unir":
+        nodo = {**nodo, "izq": _reescribir(nodo["izq"]), "der": _reescribir(nodo["der"])}
+    elif "entrada" in nodo:
+        nodo = {**nodo, "entrada": _reescribir(nodo["entrada"])}
+    if nodo["op"] == "filtro":
+        return _bajar_filtro(nodo)
+    if nodo["op"] == "agrupar":
+        return _fusionar_agrupaciones(nodo)
+    return nodo
+
+# Empuja el filtro lo más abajo posible sin cambiar el resultado
+def _bajar_filtro(filtro):
+    hijo, columna = filtro["entrada"], filtro["columna"]
+    op = hijo["op"]
+    pasa = (
+        op in ("filtro", "proyectar")
+        or (op == "calcular" and columna != hijo["columna"])
+        or (op == "agrupar" and columna in hijo["por"])
+    )
+    if pasa:
+        return {**hijo, "entrada": _bajar_filtro({**filtro, "entrada": hijo["entrada"]})}
+    if op == "unir":
+        izq, der = columnas_plan(hijo["izq"]), columnas_plan(hijo["der"])
+        claves = _claves_comunes(hijo)
+        repetidas = (set(izq) & set(der)) - claves
+        if columna in repetidas:
+            return filtro
+        # En un left join filtrar el lado derecho dejaría filas con nulos en vez de quitarlas
+        por_izq = hijo["how"] in ("inner", "left") and columna in izq
+        por_der = hijo["how"] in ("inner", "right") and columna in der
+        if por_izq or por_der:
+            nuevo = dict(hijo)
+            if por_izq:
+                nuevo["izq"] = _bajar_filtro({**filtro, "entrada": hijo["izq"]})
+            if por_der:
+                nuevo["der"] = _bajar_filtro({**filtro, "entrada": hijo["der"]})
+            return nuevo
+    return filtro
+
+# agrupar(agrupar(x, [a, b], t=sum(v)), [a], t=sum(t))  ->  agrupar(filtrar(x, b no nulo), [a], t=sum(v))
+# El groupby de adentro descarta las filas con nulos en sus claves: las claves que se
+# pierden al fusionar se filtran antes, así el resultado es el mismo
+def _fusionar_agrupaciones(nodo):
+    adentro = nodo["entrada"]
+    if adentro["op"] != "agrupar" or not set(nodo["por"]) <= set(adentro["por"]):
+        return nodo
+    fusionadas = {}
+    for salida, (columna, funcion) in nodo["agregaciones"].items():
+        if columna not in adentro["agregaciones"]:
+            return nodo
+        columna_adentro, funcion_adentro = adentro["agregaciones"][columna]
+        combinada = FUSION_AGREGACIONES.get((funcion, funcion_adentro))
+        if combinada is None:
+            return nodo
+        fusionadas[salida] = (columna_adentro, combinada)
+    entrada = adentro["entrada"]
+    for columna in adentro["por"]:
+        if columna not in nodo["por"]:
+            entrada = _bajar_filtro(filtrar(entrada, columna, "notna", None))
+    return _fusionar_agrupaciones({**nodo, "entrada": entrada, "agregaciones": fusionadas})
+
+# Deja en cada paso solo las columnas que se usan más arriba (necesarias None: todas)
+def _podar(nodo, necesarias):
+    op = nodo["op"]
+    if op == "scan":
+        if necesarias is None:
+            return nodo
+        return {**nodo, "columnas": [c for c in columnas_plan(nodo) if c in necesarias]}
+    if op == "unir":
+        if necesarias is None:
+            return {**nodo, "izq": _podar(nodo["izq"], None), "der": _podar(nodo["der"], None)}
+        izq, der = set(columnas_plan(nodo["izq"])), set(columnas_plan(nodo["der"]))
+        repetidas = (izq & der) - _claves_comunes(nodo)
+        return {
+            **nodo,
+            "izq": _podar(nodo["izq"], (izq & necesarias) | set(nodo["izq_on"]) | repetidas),
+            "der": _podar(nodo["der"], (der & necesarias) | set(nodo["der_on"]) | repetidas),
+        }
+    if op == "agrupar":
+        # Las agregaciones se dejan todas: así dos reportes que agrupan igual comparten el paso
+        debajo = set(nodo["por"]) | {c for c, _ in nodo["agregaciones"].values() if c is not None}
+        return {**nodo, "entrada": _podar(nodo["entrada"], debajo)}
+    if op == "proyectar":
+        columnas = [c for c in nodo["columnas"] if necesarias is None or c in necesarias]
+        return {**nodo, "columnas": columnas, "entrada": _podar(nodo["entrada"], set(columnas))}
+    if op == "calcular":
+        if necesarias is not None and nodo["columna"] not in necesarias:
+            return _podar(nodo["entrada"], necesarias)
+        debajo = None if necesarias is None else (necesarias - {nodo["columna"]}) | set(nodo["usa"])
+        return {**nodo, "entrada": _podar(nodo["entrada"], debajo)}
+    extra = {nodo["columna"], *(nodo.get("desempate") or [])}
+    return {**nodo, "entrada": _podar(nodo["entrada"], None if necesarias is None else necesarias | extra)}
+
+#-----------------
+# Ejecución
+def ejecutar_plan(plan, optimizar=True):
+    if optimizar:
+        plan = optimizar_plan(plan)
+    tiempos = {}
+    df = _ejecutar(plan, tiempos)
+    _ultimo_plan.texto = explicar_plan(plan, tiempos)
+    if MOSTRAR_PLANES:
+        print(_ultimo_plan.texto)
+    return df
+
+# Devuelve el plan de la última ejecución y lo borra (para no mostrarlo dos veces)
+def tomar_plan():
+    texto = getattr(_ultimo_plan, "texto", "")
+    _ultimo_plan.texto = ""
+    return texto
+
+# Dentro de un lote de reportes los pasos iguales se calculan una sola vez
+def _firma(nodo):
+    def funcion(f):
+        nombre = getattr(f, "__qualname__", "")
+        if not nombre or "<" in nombre:  # lambdas y funciones internas: no se pueden comparar
+            raise TypeError
+        return f"{f.__module__}.{nombre}"
+    try:
+        return json.dumps(nodo, sort_keys=True, default=funcion)
+    except TypeError:
+        return None
+
+def _ejecutar(nodo, tiempos):
+    pasos = getattr(_lote, "pasos", None)
+    firma = _firma(nodo) if pasos is not None else None
+    if firma is not None and firma in pasos:
+        df = pasos[firma]
+        tiempos[id(nodo)] = (0.0, len(df), "compartido")
+        return df
+    inicio = time.perf_counter()
+    op = nodo["op"]
+    if op == "scan":
+        df = _escanear(nodo)
+    elif op == "unir":
+        df = _unir(_ejecutar(nodo["izq"], tiempos), _ejecutar(nodo["der"], tiempos), nodo)
+    elif op == "agrupar" and _tabla_por_partes(nodo["entrada"]) is not None:
+        df = _agrupar_por_partes(nodo, tiempos)
+    else:
+        df = _paso(nodo, _ejecutar(nodo["entrada"], tiempos))
+    tiempos[id(nodo)] = (time.perf_counter() - inicio, len(df), None)
+    if firma is not None:
+        pasos[firma] = df
+    return df
+
+def _escanear(nodo):
+    tabla, columnas = nodo["tabla"], nodo["columnas"]
+    if tabla in FUENTES_CUBO:
+        cubo = cubo_ventas()
+        if cubo is None:
+            raise ValueError("No se pudo armar el cubo de ventas")
+        df = cubo[FUENTES_CUBO[tabla][0]].reset_index()
+        return df if columnas is None else df[columnas]
+    if tabla not in csvs:
+        raise KeyError(f"Falta el archivo: {tabla}")
+    return pd.concat(iterar_tabla(tabla, columnas), ignore_index=True) if es_streaming(tabla) else (
+        csvs[tabla]["df"] if columnas is None else csvs[tabla]["df"][columnas])
+
+def _unir(izq, der, nodo):
+    # Claves de tipos distintos (ej: texto contra número) se comparan como números
+    for i, d in zip(nodo["izq_on"], nodo["der_on"]):
+        numericas = pd.api.types.is_numeric_dtype(izq[i]), pd.api.types.is_numeric_dtype(der[d])
+        if numericas[0] != numericas[1]:
+            izq = izq.assign(**{i: pd.to_numeric(izq[i], errors="coerce")})
+            der = der.assign(**{d: pd.to_numeric(der[d], errors="coerce")})
+    if nodo["izq_on"] == nodo["der_on"]:
+        return pd.merge(izq, der, on=nodo["izq_on"], how=nodo["how"])
+    return pd.merge(izq, der, left_on=nodo["izq_on"], right_on=nodo["der_on"], how=nodo["how"])
+
+# Pasos de una sola entrada, aplicados a un DataFrame ya calculado
+def _paso(nodo, df):
+    op = nodo["op"]
+    if op == "filtro":
+        return df[OPERADORES_FILTRO[nodo["operador"]](df[nodo["columna"]], nodo["valor"])]
+    if op == "calcular":
+        return df.assign(**{nodo["columna"]: nodo["expresion"](df)})
+    if op == "proyectar":
+        return df[nodo["columnas"]]
+    if op == "primeros":
+        return top_k(df, nodo["columna"], nodo["k"], nodo.get("desempate"), nodo["ascendente"])
+    if op == "agrupar":
+        return _agrupar(df, nodo["por"], nodo["agregaciones"]).reset_index()
+    raise ValueError(f"Paso desconocido: {op}")
+
+def _agrupar(df, por, agregaciones):
+    return df.groupby(por, observed=True).agg(**{
+        salida: (por[0] if columna is None else columna, funcion)
+        for salida, (columna, funcion) in agregaciones.items()
+    })
+
+# Tabla en streaming debajo de una cadena de filtros/cálculos: se agrupa parte por parte
+def _tabla_por_partes(nodo):
+    while nodo["op"] in ("filtro", "calcular", "proyectar"):
+        nodo = nodo["entrada"]
+    if nodo["op"] == "scan" and es_streaming(nodo["tabla"]):
+        return nodo
+    return None
+
+def _agrupar_por_partes(nodo, tiempos):
+    agregaciones = nodo["agregaciones"]
+    if any(f not in COMBINAR_PARCIALES and f != "mean" for _, f in agregaciones.values()):
+        return _paso(nodo, _ejecutar(nodo["entrada"], tiempos))
+    # Las medias se calculan como suma / cantidad al final
+    parciales_def = {}
+    for salida, (columna, funcion) in agregaciones.items():
+        if funcion == "mean":
+            parciales_def[f"{salida}__suma"] = (columna, "sum")
+            parciales_def[f"{salida}__cuenta"] = (columna, "count")
+        else:
+            parciales_def[salida] = (columna, funcion)
+    cadena = []
+    paso = nodo["entrada"]
+    while paso["op"] != "scan":
+        cadena.append(paso)
+        paso = paso["entrada"]
+    cadena.reverse()
+    acumulados = {id(p): [0.0, 0] for p in [paso, *cadena]}
+    parciales = []
+    inicio = time.perf_counter()
+    for parte in iterar_tabla(paso["tabla"], paso["columnas"]):
+        acumulados[id(paso)][0] += time.perf_counter() - inicio
+        acumulados[id(paso)][1] += len(parte)
+        for p in cadena:
+            inicio = time.perf_counter()
+            parte = _paso(p, parte)
+            acumulados[id(p)][0] += time.perf_counter() - inicio
+            acumulados[id(p)][1] += len(parte)
+        parciales.append(_agrupar(parte, nodo["por"], parciales_def))
+        inicio = time.perf_counter()
+    # Tiempos acumulados por paso: lo que tardó cada uno (con los de abajo) sumando todas las partes
+    transcurrido = 0.0
+    for p in [paso, *cadena]:
+        transcurrido += acumulados[id(p)][0]
+        tiempos[id(p)] = (transcurrido, acumulados[id(p)][1], "por partes")
+    if not parciales:
+        return pd.DataFrame(columns=nodo["por"] + list(agregaciones))
+    total = pd.concat(parciales).groupby(level=nodo["por"], observed=True).agg(
+        {s: COMBINAR_PARCIALES[f] for s, (_, f) in parciales_def.items()})
+    for salida, (_, funcion) in agregaciones.items():
+        if funcion == "mean":
+            total[salida] = total.pop(f"{salida}__suma") / total.pop(f"{salida}__cuenta")
+    return total[list(agregaciones)].reset_index()
+
+#-----------------
+# Plan en texto: un paso por línea, con lo que tardó (sin contar sus entradas) y las filas
+def explicar_plan(nodo, tiempos=None, nivel=0):
+    linea = "  " * nivel + _describir(nodo)
+    if tiempos and id(nodo) in tiempos:
+        segundos, filas, nota = tiempos[id(nodo)]
+        propios = segundos - sum(tiempos.get(id(h), (0.0,))[0] for h in _hijos(nodo))
+        linea += f"  [{max(propios, 0.0):.4f}s, {filas} filas{', ' + nota if nota else ''}]"
+    return "\n".join([linea] + [explicar_plan(h, tiempos, nivel + 1) for h in _hijos(nodo)])
+
+def _describir(nodo):
+    op = nodo["op"]
+    if op == "scan":
+        columnas = "*" if nodo["columnas"] is None else ", ".join(nodo["columnas"])
+        return f"escanear {nodo['tabla']} [{columnas}]"
+    if op == "filtro":
+        if nodo["operador"] == "notna":
+            return f"filtrar {nodo['columna']} no nulo"
+        return f"filtrar {nodo['columna']} {nodo['operador']} {nodo['valor']!r}"
+    if op == "unir":
+        return f"unir ({nodo['how']}) {', '.join(nodo['izq_on'])} = {', '.join(nodo['der_on'])}"
+    if op == "agrupar":
+        agregaciones = ", ".join(f"{s}={f}({c or ''})" for s, (c, f) in nodo["agregaciones"].items())
+        return f"agrupar por {', '.join(nodo['por'])}: {agregaciones}"
+    if op == "calcular":
+        return f"calcular {nodo['columna']} (con {', '.join(nodo['usa'])})"
+    if op == "proyectar":
+        return f"proyectar [{', '.join(nodo['columnas'])}]"
+    orden = "menor" if nodo["ascendente"] else "mayor"
+    return f"primeros {nodo['k'] if nodo['k'] is not None else 'todos'} por {nodo['columna']} ({orden} primero)"
+
+# Tablas cargadas que lee un plan (los niveles del cubo salen de TABLAS_CUBO)
+def tablas_plan(nodo):
+    if nodo["op"] == "scan":
+        return set(TABLAS_CUBO) if nodo["tabla"] in FUENTES_CUBO else {nodo["tabla"]}
+    return set().union(*(tablas_plan(h) for h in _hijos(nodo)))
+
+#-----------------
+# Caché de resultados de reportes en disco (DIR_CACHE/reportes), compartida entre
+# sesiones y analistas: la clave es el reporte, sus parámetros y la huella de cada
+# tabla de entrada, así un resultado sirve mientras los datos sean los mismos.
+# Si se pasa de MAX_CACHE_REPORTES se borran los usados hace más tiempo.
+USAR_CACHE_REPORTES = True
+MAX_CACHE_REPORTES = 256 * 1024 * 1024  # bytes en disco
+EXTENSIONES_REPORTE = (".parquet", ".pkl")
+
+# Los contadores son del proceso (todas las sesiones del dashboard los comparten)
+_contadores_cache = {"aciertos": 0, "fallos": 0, "guardados": 0, "descartados": 0}
+_lock_contadores_cache = threading.Lock()
+_lock_cache_reportes = threading.Lock()
+
+def _contar_cache(contador):
+    with _lock_contadores_cache:
+        _contadores_cache[contador] += 1
+
+def _dir_cache_reportes():
+    return os.path.join(DIR_CACHE, "reportes")
+
+def clave_reporte(reporte, parametros, tablas, detalle=None):
+    huellas = {t: huella_tabla(t) if t in csvs else None for t in sorted(tablas)}
+    # El esquema y la config de tipos cambian los dtypes de las tablas y con eso el resultado
+    contenido = {"reporte": reporte, "parametros": parametros or {}, "huellas": huellas, "detalle": detalle,
+                 "esquema": firma_esquema()}
+    return hashlib.sha1(json.dumps(contenido, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def leer_reporte_cacheado(clave):
+    base = os.path.join(_dir_cache_reportes(), clave)
+    for ext in EXTENSIONES_REPORTE:
+        ruta = base + ext
+        if not os.path.exists(ruta):
+            continue
+        try:
+            df = pd.read_parquet(ruta) if ext == ".parquet" else pd.read_pickle(ruta)
+            os.utime(ruta)  # la fecha de modificación marca el último uso
+            return df
+        except Exception:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+    return None
+
+def guardar_reporte_cacheado(clave, df):
+    try:
+        os.makedirs(_dir_cache_reportes(), exist_ok=True)
+        base = os.path.join(_dir_cache_reportes(), clave)
+        # Se escribe aparte y se renombra: otra sesión nunca lee un archivo a medias
+        try:
+            if FORMATO_CACHE != "parquet":
+                raise ValueError
+            df.to_parquet(base + ".tmp")
+            os.replace(base + ".tmp", base + ".parquet")
+        except Exception:
+            df.to_pickle(base + ".tmp")
+            os.replace(base + ".tmp", base + ".pkl")
+        _contar_cache("guardados")
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar el reporte en la caché: {e}")
+        return
+    _recortar_cache_reportes()
+
+def _archivos_cache_reportes():
+    directorio = _dir_cache_reportes()
+    if not os.path.isdir(directorio):
+        return []
+    archivos = []
+    for archivo in os.listdir(directorio):
+        if os.path.splitext(archivo)[1] in EXTENSIONES_REPORTE:
+            try:
+                info = os.stat(os.path.join(directorio, archivo))
+            except OSError:
+                continue  # otra sesión lo acaba de borrar
+            archivos.append((info.st_mtime, info.st_size, os.path.join(directorio, archivo)))
+    return archivos
+
+def _recortar_cache_reportes():
+    with _lock_cache_reportes:
+        archivos = sorted(_archivos_cache_reportes())
+        total = sum(tamaño for _, tamaño, _ in archivos)
+        for _, tamaño, ruta in archivos:
+            if total <= MAX_CACHE_REPORTES:
+                break
+            try:
+                os.remove(ruta)
+            except OSError:
+                continue
+            total -= tamaño
+            _contar_cache("descartados")
+
+def limpiar_cache_reportes():
+    if os.path.isdir(_dir_cache_reportes()):
+        shutil.rmtree(_dir_cache_reportes())
+
+# Contadores desde que arrancó el proceso y tamaño actual de la caché
+def estadisticas_cache_reportes():
+    archivos = _archivos_cache_reportes()
+    with _lock_contadores_cache:
+        contadores = dict(_contadores_cache)
+    return {**contadores, "entradas": len(archivos), "bytes": sum(tamaño for _, tamaño, _ in archivos)}
+
+# En modo sql el resultado depende de la base y no de las tablas cargadas: no se guarda
+def _cacheado(reporte, parametros, tablas, calcular, detalle=None):
+    if not (USAR_CACHE and USAR_CACHE_REPORTES) or obtener_modo_reportes() != "pandas":
+        return calcular()
+    clave = clave_reporte(reporte, parametros, tablas, detalle)
+    df = leer_reporte_cacheado(clave)
+    if df is not None:
+        _contar_cache("aciertos")
+        return df
+    _contar_cache("fallos")
+    df = calcular()
+    if df is not None:
+        guardar_reporte_cacheado(clave, df)
+    return df
+
+#-----------------
+# Consultas sobre el cubo (los reportes de abajo), como planes.
+# Durante un lote de reportes (ver ejecutar_reportes) los pasos repetidos entre
+# reportes se calculan una sola vez. Cada hilo (cada sesión del dashboard) tiene su lote:
+# una sesión nunca ve los pasos calculados por otra
+_lote = threading.local()  # pasos: {firma del paso: resultado} mientras corre un lote
+
+def _faltan(*nombres):
+    faltantes = [n for n in nombres if n not in csvs]
+    for n in faltantes:
+        print(f"❌ Falta el archivo: {n}")
+    return bool(faltantes)
+
+# reporte y parametros: para guardar el resultado en la caché de reportes
+def _resultado(plan, reporte=None, parametros=None):
+    try:
+        if reporte is None:
+            return ejecutar_plan(plan)
+        ejecutado = []
+        def calcular():
+            ejecutado.append(True)
+            return ejecutar_plan(plan)
+        df = _cacheado(reporte, parametros, tablas_plan(plan), calcular, detalle=_firma(plan))
+        if not ejecutado:
+            _ultimo_plan.texto = "♻️ Resultado de la caché de reportes (no se ejecutó el plan)"
+        return df
+    except (KeyError, ValueError) as e:
+        print(f"❌ {e.args[0] if e.args else e}")
+        return None
+
+# Total y cantidad de facturas por cliente, con el nombre del cliente
+def _plan_facturas_por_cliente():
+    por_cliente = agrupar(escanear("cubo.facturas"), "id_cliente", total=("total", "sum"), facturas=("facturas", "sum"))
+    return unir(por_cliente, escanear("clientes"), "id_cliente")
+
+# Cantidad vendida de cada producto
+def _plan_cantidad_por_producto():
+    cantidades = agrupar(escanear("cubo.renglones"), "id_producto", cantidad=("cantidad", "sum"))
+    return filtrar(cantidades, "id_producto", ">=", 0)
+
+def _ticket(df):
+    return df["total"] / df["facturas"]
+
+def _importe(df):
+    return df["cantidad"] * df["precio_unitario"]
+
+#-----------------
+# Reportes en la base de datos: con MODO_REPORTES = "sql" cada reporte se compila a una
+# consulta que corre en el motor y solo vuelven las filas del resultado.
+# Las tablas tienen que estar en la base con los mismos nombres (ver upload_to_sql).
+# URL_REPORTES permite usar otra base, ej: "sqlite:///prueba.db" para probar sin MySQL.
+# Son los valores por defecto: configurar_reportes() los cambia solo para el hilo actual
+# (cada sesión del dashboard corre en el suyo), así una sesión no le cambia el modo a otra.
+MODO_REPORTES = "pandas"  # "pandas" | "sql"
+URL_REPORTES = None       # None: el de obtener_engine()
+
+SQL_REPORTES = {
+    "ranking": """
+        SELECT c.nombre, SUM(f.total) AS total
+        FROM facturas_enc f JOIN clientes c ON c.id_cliente = f.id_cliente
+        GROUP BY c.nombre
+        ORDER BY total DESC{limite}""",
+    "ticket_promedio": """
+        SELECT c.nombre, SUM(f.total) / COUNT(*) AS ticket_promedio
+        FROM facturas_enc f JOIN clientes c ON c.id_cliente = f.id_cliente
+        GROUP BY c.nombre""",
+    "ventas_por_mes": """
+        SELECT {mes} AS mes, SUM(total) AS total
+        FROM facturas_enc
+        WHERE fecha IS NOT NULL
+        GROUP BY {mes}
+        ORDER BY mes""",
+    "top_facturas": """
+        SELECT f.id_factura, f.fecha, c.nombre, f.total
+        FROM facturas_enc f LEFT JOIN clientes c ON c.id_cliente = f.id_cliente
+        WHERE EXISTS (SELECT 1 FROM facturas_det d WHERE d.id_factura = f.id_factura)
+        ORDER BY f.total DESC{limite}""",
+    "top_prods": """
+        SELECT t.id_producto, t.cantidad{productos}
+        FROM (SELECT id_producto, SUM(cantidad) AS cantidad
+              FROM facturas_det
+              WHERE id_producto IS NOT NULL
+              GROUP BY id_producto
+              ORDER BY cantidad DESC{limite}) t
+        LEFT JOIN productos p ON p.id_producto = t.id_producto
+        ORDER BY t.cantidad DESC""",
+    "det_rubro": """
+        SELECT t.id_rubro, t.cantidad{rubros}
+        FROM (SELECT p.id_rubro, SUM(d.cantidad) AS cantidad
+              FROM facturas_det d JOIN productos p ON p.id_producto = d.id_producto
+              WHERE p.id_rubro IS NOT NULL
+              GROUP BY p.id_rubro) t
+        LEFT JOIN rubros r ON r.id_rubro = t.id_rubro""",
+    "fac_prod": """
+        SELECT p.descripcion, SUM(d.cantidad * p.precio_unitario) AS importe
+        FROM facturas_det d JOIN productos p ON p.id_producto = d.id_producto
+        GROUP BY p.descripcion
+        ORDER BY importe DESC{limite}""",
+}
+
+_motores = {}
+
+_config_reportes = threading.local()
+
+def configurar_reportes(modo, url=None):
+    if modo not in ("pandas", "sql"):
+        raise ValueError(f"Modo de reportes desconocido: {modo}")
+    _config_reportes.modo, _config_reportes.url = modo, url or None
+
+def obtener_modo_reportes():
+    return getattr(_config_reportes, "modo", MODO_REPORTES)
+
+def obtener_url_reportes():
+    return _config_reportes.url if hasattr(_config_reportes, "modo") else URL_REPORTES
+
+def motor_reportes():
+    url = obtener_url_reportes()
+    if url is None:
+        return obtener_engine()
+    with _lock_engine:
+        if url not in _motores:
+            _motores[url] = sqlalchemy.create_engine(url, **_opciones_pool(url))
+        return _motores[url]
+
+# Mes (AAAA-MM) de una columna fecha en el dialecto del motor
+def _sql_mes(motor, columna):
+    dialecto = motor.dialect.name
+    if dialecto == "sqlite":
+        return f"strftime('%Y-%m', {columna})"
+    if dialecto == "postgresql":
+        return f"to_char({columna}, 'YYYY-MM')"
+    return f"DATE_FORMAT({columna}, '%Y-%m')"
+
+# Columnas de una tabla de la base para el SELECT (", p.nombre, p.descripcion, ...")
+def _sql_columnas(motor, tabla, alias, excluir):
+    columnas = [c["name"] for c in sqlalchemy.inspect(motor).get_columns(tabla) if c["name"] != excluir]
+    return "".join(f", {alias}.{c}" for c in columnas)
+
+def reporte_sql(nombre, k=None):
+    motor = motor_reportes()
+    partes = {"limite": f" LIMIT {int(k)}" if k is not None else "", "mes": _sql_mes(motor, "fecha")}
+    if nombre == "top_prods":
+        partes["productos"] = _sql_columnas(motor, "productos", "p", "id_producto")
+    elif nombre == "det_rubro":
+        partes["rubros"] = _sql_columnas(motor, "rubros", "r", "id_rubro")
+    consulta = SQL_REPORTES[nombre].format(**partes)
+    with motor.connect() as conexion:
+        df = pd.read_sql(sqlalchemy.text(consulta), conexion)
+    if nombre == "ventas_por_mes":
+        df = pd.DataFrame({"fecha": pd.PeriodIndex(df["mes"], freq="M"), "total": df["total"]})
+    elif "fecha" in df.columns:
+        # SQLite devuelve las fechas como texto
+        df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
+    return df
+
+def _mostrar_sql(nombre, titulo, k=None):
+    try:
+        df = reporte_sql(nombre, k)
+    except Exception as e:
+        print(f"❌ Error al ejecutar {nombre} en la base: {e}")
+        return None
+    print(titulo)
+    print(df)
+    return df
+
+#-----------------
+# Consultas SQL sobre las tablas cargadas, sin pasar por la base de datos
+# Con duckdb cada DataFrame del registro se ve como una tabla sin copiarlo (y las tablas en
+# streaming se leen directo del CSV). Sin duckdb se copian a un SQLite en memoria, solo
+# las que cambiaron desde la consulta anterior.
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+_consultas = {"conexion": None, "tablas": {}}  # tablas: nombre -> (version, tipo)
+_lock_consultas = threading.Lock()
+
+def motor_consultas():
+    return "duckdb" if duckdb is not None else "sqlite"
+
+def _quitar_tabla(conexion, nombre, tipo):
+    if tipo == "vista":
+        conexion.execute(f'DROP VIEW IF EXISTS "{nombre}"')
+    elif tipo == "registrada":
+        conexion.unregister(nombre)
+    else:
+        conexion.execute(f'DROP TABLE IF EXISTS "{nombre}"')
+
+def _registrar_tablas(conexion):
+    tablas = _consultas["tablas"]
+    for nombre, (version, tipo) in list(tablas.items()):
+        if nombre not in csvs or version_tabla(nombre) != version:
+            _quitar_tabla(conexion, nombre, tipo)
+            del tablas[nombre]
+    for nombre, datos in csvs.items():
+        if nombre in tablas:
+            continue
+        if duckdb is not None and es_streaming(nombre):
+            ruta = datos["ruta"].replace("'", "''")
+            conexion.execute(f"CREATE VIEW \"{nombre}\" AS SELECT * FROM read_csv_auto('{ruta}', delim='{datos.get('sep', ',')}')")
+            tipo = "vista"
+        elif duckdb is not None:
+            conexion.register(nombre, datos["df"])
+            tipo = "registrada"
+        elif es_streaming(nombre):
+            print(f"⚠️ {nombre} está en modo streaming: sin duckdb no se puede consultar.")
+            continue
+        else:
+            datos["df"].to_sql(nombre, conexion, if_exists="replace", index=False)
+            tipo = "copiada"
+        tablas[nombre] = (version_tabla(nombre), tipo)
+
+# Devuelve (resultado, segundos)
+def consultar_sql(consulta):
+    with _lock_consultas:
+        inicio = time.perf_counter()
+        if _consultas["conexion"] is None:
+            if duckdb is not None:
+                _consultas["conexion"] = duckdb.connect()
+            else:
+                _consultas["conexion"] = sqlite3.connect(":memory:", check_same_thread=False)
+        conexion = _consultas["conexion"]
+        _registrar_tablas(conexion)
+        if duckdb is not None:
+            df = conexion.execute(consulta).df()
+        else:
+            df = pd.read_sql_query(consulta, conexion)
+        return df, time.perf_counter() - inicio
+
 # -------------------------------
 # Ranking de clientes por total comprado
 # -------------------------------
-def ranking():
-    ventas_clientes = vc()
-    if ventas_clientes is None:
+def ranking(k=TOP_K):
+    if obtener_modo_reportes() == "sql":
+        return _mostrar_sql("ranking", "Top clientes por total comprado:", k)
+    if _faltan("facturas_enc", "clientes"):
+        return
+    plan = agrupar(_plan_facturas_por_cliente(), 'nombre', total=('total', 'sum'))
+    df_ranking = _resultado(primeros(plan, 'total', k), "ranking", {"k": k})
+    if df_ranking is None:
         print("No se pudo generar el DataFrame combinado.")
         return
-    df_ranking = ventas_clientes.groupby('nombre')['total'].sum().reset_index()
-    df_ranking = df_ranking.sort_values(by='total', ascending=False)
-    print("Top 10 clientes por total comprado:")
-    print(df_ranking.head(10))
+    print(f"Top {len(df_ranking)} clientes por total comprado:")
+    print(df_ranking)
     return df_ranking
 
 # -------------------------------
 # Ticket promedio por cliente
 # -------------------------------
 def ticket_promedio():
-    ventas_clientes = vc()
-    if ventas_clientes is None:
+    if obtener_modo_reportes() == "sql":
+        return _mostrar_sql("ticket_promedio", "Ticket promedio por cliente:")
+    if _faltan("facturas_enc", "clientes"):
+        return
+    plan = agrupar(_plan_facturas_por_cliente(), 'nombre', total=('total', 'sum'), facturas=('facturas', 'sum'))
+    plan = calcular_columna(plan, 'ticket_promedio', _ticket, ['total', 'facturas'])
+    df_ticket = _resultado(proyectar(plan, ['nombre', 'ticket_promedio']), "ticket_promedio")
+    if df_ticket is None:
         return
-    df_ticket = ventas_clientes.groupby('nombre')['total'].mean().reset_index()
-    df_ticket.rename(columns={'total': 'ticket_promedio'}, inplace=True)
     print("Top 10 clientes con mayor ticket promedio:")
-    print(df_ticket.sort_values(by='ticket_promedio', ascending=False).head(10))
+    print(top_k(df_ticket, 'ticket_promedio'))
     return df_ticket
 
 # -------------------------------
 # Ventas por mes
 # -------------------------------
 def ventas_por_mes():
-    ventas_clientes = vc()
-    if ventas_clientes is None:
+    if obtener_modo_reportes() == "sql":
+        return _mostrar_sql("ventas_por_mes", "Ventas por mes:")
+    if _faltan("facturas_enc"):
         return
-    if 'fecha_y' not in ventas_clientes.columns:
-        print("❌ La columna 'fecha_y' no está disponible.")
+    if 'fecha' not in columnas_tabla("facturas_enc"):
+        print("❌ La columna 'fecha' no está disponible.")
         return
-    ventas_clientes['fecha_y'] = pd.to_datetime(ventas_clientes['fecha_y'], errors='coerce')
-    df_mes = ventas_clientes.groupby(ventas_clientes['fecha_y'].dt.to_period('M'))['total'].sum().reset_index()
+    plan = agrupar(filtrar(escanear("cubo.facturas"), "mes", ">=", 0), "mes", total=("total", "sum"))
+    por_mes = _resultado(plan, "ventas_por_mes")
+    if por_mes is None:
+        return
+    meses = pd.to_datetime(por_mes["mes"].astype(str), format="%Y%m").dt.to_period('M')
+    df_mes = pd.DataFrame({'fecha': meses, 'total': por_mes['total']})
     print("Ventas por mes:")
     print(df_mes)
     return df_mes
@@ -304,34 +3117,45 @@ def ventas_por_mes():
 # -------------------------------
 # Facturas más altas
 # -------------------------------
-def top_facturas():
-    ventas_clientes = vc()
-    if ventas_clientes is None:
+def top_facturas(k=TOP_K):
+    if obtener_modo_reportes() == "sql":
+        return _mostrar_sql("top_facturas", "Facturas con mayores totales:", k)
+    top_fact = _cacheado("top_facturas", {"k": k}, TABLAS_VC, lambda: _top_facturas(k))
+    if top_fact is None:
         return
-    columnas_requeridas = ['id_factura', 'fecha_y', 'nombre', 'total']
+    print("Facturas con mayores totales:")
+    print(top_fact)
+    return top_fact
+
+def _top_facturas(k):
+    partes = vc_partes()
+    if partes is None:
+        return None
+    columnas_requeridas = ['id_factura', 'fecha', 'nombre', 'total']
+    primera, partes = _primera_parte(_por_factura(partes))
+    if primera is None:
+        return None
     for col in columnas_requeridas:
-        if col not in ventas_clientes.columns:
+        if col not in primera.columns:
             print(f"❌ Falta la columna '{col}' en los datos.")
-            return
-    top_fact = ventas_clientes.sort_values(by='total', ascending=False).head(10)
-    print("Facturas con mayores totales:")
-    print(top_fact[columnas_requeridas])
-    return top_fact[columnas_requeridas]
+            return None
+    return top_k_partes((parte[columnas_requeridas] for parte in partes), 'total', k)
 
 # -------------------------------
 # Producto más vendido en cantidad
 # -------------------------------
-def top_prods():
-    dfs = get_csvs_requeridos("facturas_det", "productos")
-    if not dfs:
+def top_prods(k=1):
+    if obtener_modo_reportes() == "sql":
+        return _mostrar_sql("top_prods", "Producto más vendido por cantidad:", k)
+    if _faltan("facturas_det", "productos"):
         return
-    facturas_det, productos = dfs
-    if 'id_producto' not in facturas_det.columns or 'cantidad' not in facturas_det.columns:
+    if not {'id_producto', 'cantidad'}.issubset(columnas_tabla("facturas_det")):
         print("❌ Columnas necesarias no están presentes en facturas_det.")
         return
-    prod_qty = facturas_det.groupby('id_producto')['cantidad'].sum().reset_index()
-    prod_qty = pd.merge(prod_qty, productos, on='id_producto', how='left')
-    resultado = prod_qty.sort_values(by='cantidad', ascending=False).head(1)
+    plan = primeros(_plan_cantidad_por_producto(), 'cantidad', k)
+    resultado = _resultado(unir(plan, escanear("productos"), 'id_producto', how='left'), "top_prods", {"k": k})
+    if resultado is None:
+        return
     print("Producto más vendido por cantidad:")
     print(resultado)
     return resultado
@@ -340,20 +3164,18 @@ def top_prods():
 # Ventas totales por rubro
 # -------------------------------
 def det_rubro():
-    dfs = get_csvs_requeridos("facturas_det", "productos", "rubros")
-    if not dfs:
+    if obtener_modo_reportes() == "sql":
+        return _mostrar_sql("det_rubro", "Ventas por rubro:")
+    if _faltan("facturas_det", "productos", "rubros"):
         return
-    facturas_det, productos, rubros = dfs
-    try:
-        df = pd.merge(facturas_det, productos, on='id_producto', how='left')
-        df = pd.merge(df, rubros, on='id_rubro', how='left')
-        rubro_sum = df.groupby('nombre')['cantidad'].sum().reset_index()
-        print("Ventas por rubro:")
-        print(rubro_sum.sort_values(by='cantidad', ascending=False))
-        return rubro_sum
-    except Exception as e:
-        print(f"❌ Error al calcular ventas por rubro: {e}")
+    por_rubro = agrupar(escanear("cubo.renglones"), 'id_rubro', cantidad=('cantidad', 'sum'))
+    plan = unir(filtrar(por_rubro, 'id_rubro', '>=', 0), escanear("rubros"), 'id_rubro', how='left')
+    rubro_sum = _resultado(plan, "det_rubro")
+    if rubro_sum is None:
         return
+    print("Ventas por rubro:")
+    print(rubro_sum.sort_values(by='cantidad', ascending=False))
+    return rubro_sum
 
 # -------------------------------
 # Gráfico de ventas mensuales
@@ -363,36 +3185,152 @@ def grafico_ventas_mensuales():
     if df_ventas is None or df_ventas.empty:
         print("❌ No hay datos para graficar.")
         return
-    df_ventas.set_index('fecha_y', inplace=True)
-    df_ventas['total'].plot(kind='bar', figsize=(10, 5), color='skyblue')
-    plt.title('Ventas Mensuales')
-    plt.xlabel('Mes')
-    plt.ylabel('Total de Ventas')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
+    figura_ventas_mensuales(df_ventas)
     plt.show()
 
+def figura_ventas_mensuales(df_ventas):
+    fig, ax = plt.subplots(figsize=(10, 5))
+    df_ventas.set_index('fecha')['total'].plot(kind='bar', ax=ax, color='skyblue')
+    ax.set_title('Ventas Mensuales')
+    ax.set_xlabel('Mes')
+    ax.set_ylabel('Total de Ventas')
+    plt.setp(ax.get_xticklabels(), rotation=45)
+    fig.tight_layout()
+    return fig
+
 # -------------------------------
 # Top productos por facturación
 # -------------------------------
-def fac_prod():
-    dfs = get_csvs_requeridos("facturas_det", "productos", "rubros")
-    if not dfs:
+def fac_prod(k=TOP_K):
+    if obtener_modo_reportes() == "sql":
+        return _mostrar_sql("fac_prod", "Top productos por facturación:", k)
+    if _faltan("facturas_det", "productos", "rubros"):
         return
-    facturas_det, productos, rubros = dfs
-    if not {'id_producto', 'cantidad'}.issubset(facturas_det.columns):
+    if not {'id_producto', 'cantidad'}.issubset(columnas_tabla("facturas_det")):
         print("❌ Columnas faltantes en facturas_det.")
         return
-    if 'precio_unitario' not in productos.columns:
+    if 'precio_unitario' not in columnas_tabla("productos"):
         print("❌ Falta la columna 'precio_unitario' en productos.")
         return
-    merged = pd.merge(facturas_det, productos, on='id_producto', how='left')
-    merged['importe'] = merged['cantidad'] * merged['precio_unitario']
-    ranking = merged.groupby('descripcion')['importe'].sum().reset_index()
-    top10 = ranking.sort_values(by='importe', ascending=False).head(10)
+    plan = unir(_plan_cantidad_por_producto(), escanear("productos"), 'id_producto', how='left')
+    plan = calcular_columna(plan, 'importe', _importe, ['cantidad', 'precio_unitario'])
+    top = _resultado(primeros(agrupar(plan, 'descripcion', importe=('importe', 'sum')), 'importe', k), "fac_prod", {"k": k})
+    if top is None:
+        return
     print("Top productos por facturación:")
-    print(top10)
-    return top10
+    print(top)
+    return top
+
+# -------------------------------
+# Resumen de las tablas cargadas
+# -------------------------------
+def estadisticas_generales():
+    filas = []
+    for nombre in csvs:
+        total, nulos = 0, 0
+        for parte in iterar_tabla(nombre):
+            total += len(parte)
+            nulos += int(parte.isna().sum().sum())
+        df = csvs[nombre]["df"]
+        filas.append({
+            "tabla": nombre, "filas": total, "columnas": len(columnas_tabla(nombre)), "nulos": nulos,
+            # En streaming habría que tener todas las filas a la vez para buscar repetidas
+            "duplicados": int(df.duplicated().sum()) if df is not None else None,
+        })
+    resumen = pd.DataFrame(filas)
+    print("Estadísticas generales:")
+    print(resumen)
+    return resumen
+
+#-----------------
+# Todos los reportes de una pasada (ej: el proceso nocturno del pack de gerencia).
+# Cada tabla se recorre una vez: el cubo y la unión vc quedan memorizados y los
+# pasos de plan repetidos entre reportes se calculan una sola vez (ver _ejecutar).
+# nombre -> (título, función, k por defecto o None si el reporte no es un top)
+REPORTES = {
+    "estadisticas": ("📈 Estadísticas Generales", estadisticas_generales, None),
+    "ranking": ("🏆 Ranking de Clientes", ranking, TOP_K),
+    "ticket_promedio": ("💰 Ticket Promedio", ticket_promedio, None),
+    "top_facturas": ("📊 Facturas Más Altas", top_facturas, TOP_K),
+    "ventas_por_mes": ("📅 Ventas por Mes", ventas_por_mes, None),
+    "top_prods": ("🎯 Producto Más Vendido", top_prods, 1),
+    "det_rubro": ("📦 Ventas por Rubro", det_rubro, None),
+    "fac_prod": ("💎 Top Productos por Facturación", fac_prod, TOP_K),
+}
+# El gráfico de ventas mensuales sale del resultado de ventas_por_mes al exportar
+DIR_REPORTES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reportes")
+
+try:
+    import openpyxl  # noqa: F401
+    EXCEL_REPORTES = True
+except ImportError:
+    EXCEL_REPORTES = False
+
+# Devuelve ({nombre: df o None}, {nombre: segundos}); k reemplaza el de todos los top
+def ejecutar_reportes(nombres=None, k=None):
+    resultados, tiempos = {}, {}
+    _lote.pasos = {}
+    try:
+        for nombre in nombres or REPORTES:
+            titulo, funcion, k_reporte = REPORTES[nombre]
+            inicio = time.perf_counter()
+            try:
+                if k_reporte is None:
+                    resultados[nombre] = funcion()
+                else:
+                    resultados[nombre] = funcion(k if k is not None else k_reporte)
+            except Exception as e:
+                print(f"❌ {titulo}: {e}")
+                resultados[nombre] = None
+            tiempos[nombre] = time.perf_counter() - inicio
+    finally:
+        _lote.pasos = None
+    return resultados, tiempos
+
+# Un CSV por reporte, el gráfico en PNG, un Excel con una hoja por reporte
+# (si está openpyxl) y resumen.json con las filas y el tiempo de cada uno
+def exportar_reportes(resultados, tiempos=None, destino=None):
+    destino = destino or os.path.join(DIR_REPORTES, time.strftime("%Y-%m-%d"))
+    os.makedirs(destino, exist_ok=True)
+    listos = {nombre: df for nombre, df in resultados.items() if df is not None}
+    for nombre, df in listos.items():
+        df.to_csv(os.path.join(destino, f"{nombre}.csv"), index=False, encoding="utf-8")
+    df_ventas = listos.get("ventas_por_mes")
+    if df_ventas is not None and not df_ventas.empty:
+        fig = figura_ventas_mensuales(df_ventas)
+        fig.savefig(os.path.join(destino, "ventas_mensuales.png"))
+        plt.close(fig)
+    if EXCEL_REPORTES and listos:
+        with pd.ExcelWriter(os.path.join(destino, "reportes.xlsx")) as libro:
+            for nombre, df in listos.items():
+                # Excel no tiene tipo "período": los meses van como texto
+                periodos_df = [c for c in df.columns if isinstance(df[c].dtype, pd.PeriodDtype)]
+                df.astype({c: str for c in periodos_df}).to_excel(libro, sheet_name=nombre[:31], index=False)
+    resumen = {
+        "generado": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "modo": obtener_modo_reportes(),
+        "reportes": {
+            nombre: {
+                "filas": None if df is None else len(df),
+                "segundos": round((tiempos or {}).get(nombre, 0), 3),
+            }
+            for nombre, df in resultados.items()
+        },
+    }
+    with open(os.path.join(destino, "resumen.json"), "w", encoding="utf-8") as f:
+        json.dump(resumen, f, ensure_ascii=False, indent=2)
+    print(f"✅ {len(listos)} reportes exportados en {destino}")
+    return destino
+
+def lote_reportes(destino=None, nombres=None, k=None):
+    inicio = time.perf_counter()
+    resultados, tiempos = ejecutar_reportes(nombres, k)
+    destino = exportar_reportes(resultados, tiempos, destino)
+    fallidos = [REPORTES[n][0] for n, df in resultados.items() if df is None]
+    if fallidos:
+        print(f"⚠️ Sin resultado: {', '.join(fallidos)}")
+    print(f"⏱️ Lote completo en {time.perf_counter() - inicio:.2f}s")
+    return resultados, destino
 
 # -------------------------------
 # Crear y exportar un DataFrame básico
@@ -403,3 +3341,12 @@ def create_export(filas):
     print("✅ Datos guardados en empleados.csv")
     return df
 
+#-----------------
+# Proceso nocturno: python functions.py <directorio con los datos> [destino de los reportes]
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2:
+        print("Uso: python functions.py <directorio con los datos> [destino de los reportes]")
+        sys.exit(1)
+    cargar_directorio(sys.argv[1])
+    lote_reportes(sys.argv[2] if len(sys.argv) > 2 else None)
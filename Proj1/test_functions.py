@@ -0,0 +1,79 @@
+import os
+
+import pandas as pd
+import pytest
+
+import functions
+
+
+@pytest.fixture(autouse=True)
+def registro_limpio(tmp_path, monkeypatch):
+    monkeypatch.setattr(functions, "DIR_CACHE", str(tmp_path / "cache"))
+    functions.csvs.clear()
+    yield
+    functions.csvs.clear()
+
+
+def _escribir_rubros(directorio):
+    ruta = directorio / "rubros.csv"
+    pd.DataFrame({"id_rubro": [1, 2, 3], "descripcion": ["A", "B", "C"]}).to_csv(ruta, index=False)
+    return str(ruta)
+
+
+#-----------------
+# Journal
+def test_journal_no_se_pierde_si_el_archivo_cambia(tmp_path):
+    ruta = _escribir_rubros(tmp_path)
+    functions.cargar_directorio(str(tmp_path), formatos=("csv",))
+    functions.modificar_por_id("rubros", 1, "descripcion", "AAA")
+
+    # El archivo base cambia por fuera: el journal viejo no se aplica y queda aparte
+    info = os.stat(ruta)
+    os.utime(ruta, ns=(info.st_atime_ns, info.st_mtime_ns + 10 ** 9))
+    functions.cargar_directorio(str(tmp_path), formatos=("csv",))
+    assert os.path.exists(ruta + ".journal.viejo")
+
+    functions.modificar_por_id("rubros", 2, "descripcion", "BBB")
+    functions.cargar_directorio(str(tmp_path), formatos=("csv",))
+    df = functions.csvs["rubros"]["df"]
+    assert df.loc[df["id_rubro"] == 2, "descripcion"].item() == "BBB"
+
+
+#-----------------
+# Top k
+def test_top_k_desempata_por_texto():
+    df = pd.DataFrame({"nombre": ["b", "a", "c", "d"], "total": [5.0, 5.0, 5.0, 9.0]})
+    mejores = functions.top_k(df, "total", 2, desempate=["nombre"])
+    assert mejores["nombre"].tolist() == ["d", "c"]
+    menores = functions.top_k(df, "total", 2, desempate=["nombre"], ascendente=True)
+    assert menores["nombre"].tolist() == ["a", "b"]
+    partes = iter([df.iloc[:2], df.iloc[2:]])
+    assert functions.top_k_partes(partes, "total", 3, desempate=["nombre"])["nombre"].tolist() == ["d", "c", "b"]
+
+
+#-----------------
+# Secuencias de ids
+def test_reservar_ids_no_repite_ids_agregados_a_mano(tmp_path):
+    _escribir_rubros(tmp_path)
+    functions.cargar_directorio(str(tmp_path), formatos=("csv",))
+    assert functions.reservar_ids("rubros", 2) == [4, 5]
+    functions.editar_tabla("rubros", [{"op": "agregar", "filas": [{"id_rubro": 10, "descripcion": "X"}]}])
+    assert functions.reservar_ids("rubros") == [11]
+
+
+#-----------------
+# Optimizador de planes
+def test_fusionar_agrupaciones_con_claves_nulas(tmp_path):
+    pd.DataFrame({
+        "a": [1, 1, 2, 2, 2],
+        "b": [1.0, None, 2.0, None, 3.0],
+        "v": [10, 20, 30, 40, 50],
+    }).to_csv(tmp_path / "t.csv", index=False)
+    functions.cargar_directorio(str(tmp_path), formatos=("csv",))
+    adentro = functions.agrupar(functions.escanear("t"), ["a", "b"], v=("v", "sum"), n=("v", "count"))
+    plan = functions.agrupar(adentro, "a", v=("v", "sum"), n=("n", "sum"))
+    assert functions.optimizar_plan(plan)["entrada"]["op"] != "agrupar"  # se fusionó
+    fusionado = functions.ejecutar_plan(plan)
+    sin_fusionar = functions.ejecutar_plan(plan, optimizar=False)
+    pd.testing.assert_frame_equal(fusionado, sin_fusionar, check_dtype=False)
+    assert fusionado["v"].tolist() == [10, 80]